@@ -1,17 +1,19 @@
 # ---------------- app.py ----------------
 import streamlit as st
-import sqlite3
 import pandas as pd
 from fpdf import FPDF
-import zipfile, io, base64, time, os 
+import zipfile, io, time, os 
 from pathlib import Path
 from datetime import datetime
 import bcrypt
 
 # utils
 from utils.translator import detect_and_translate, SUPPORTED_LANGS
-from utils.ocr import extract_text_from_image, draw_bounding_boxes, export_ocr_pdf
-from utils.speech import speech_to_text, text_to_speech_bytes, SUPPORTED_SPEECH_LANGS
+from utils.ocr import OcrPipeline, build_ocr_report
+from utils.speech import text_to_speech_bytes, SUPPORTED_SPEECH_LANGS
+from utils.transcription_jobs import TranscriptionJobs, FINISHED as FINISHED_JOB_STATES
+from utils.storage import Storage, HistoryCache, HistoryWriter, HISTORY_COLUMNS
+from utils import translation_cache
 
 try:
     from audiorecorder import audiorecorder
@@ -138,43 +140,35 @@ cols[-1].markdown("<div class='example-hint'>Examples</div>", unsafe_allow_html=
 # ...existing code...
 
 # ---------------- DB HELPERS ----------------
-def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    # Add users table
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE,
-            email TEXT UNIQUE,
-            password_hash TEXT
-        )
-        """
-    )
-    # Add user_id to history
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            timestamp TEXT,
-            type TEXT, 
-            detected_lang TEXT,
-            target_lang TEXT,
-            input TEXT,
-            output TEXT,
-            extra BLOB,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-        """
-    )
-    conn.commit()
-    conn.close()
+@st.cache_resource
+def get_storage():
+    # one pooled Storage per process, shared by all sessions (migrations run on first use)
+    storage = Storage(DB_FILE)
+    translation_cache.set_storage(storage)  # translation memory lives in the same database
+    return storage
+
+storage = get_storage()
+
+@st.cache_resource
+def get_history_cache():
+    # per-user newest-rows cache; saves/clears patch only the affected user
+    return HistoryCache(get_storage())
 
-init_db() 
+history_cache = get_history_cache()
 
-conn = sqlite3.connect(DB_FILE)
+@st.cache_resource
+def get_history_writer():
+    # background batched inserts; committed rows are pushed into the history cache
+    return HistoryWriter(get_storage(), on_commit=get_history_cache().add)
+
+history_writer = get_history_writer()
+
+@st.cache_resource
+def get_transcription_jobs():
+    # worker processes keep a warm Whisper model; sessions submit jobs and poll
+    return TranscriptionJobs()
+
+transcription_jobs = get_transcription_jobs()
 
 # --- AUTH HELPERS ---
 def hash_password(password):
@@ -184,66 +178,51 @@ def check_password(password, hashed):
     return bcrypt.checkpw(password.encode(), hashed.encode())
 
 def get_user(username):
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("SELECT id, username, password_hash FROM users WHERE username=?", (username,))
-    user = cur.fetchone()
-    conn.close()
-    return user  # (id, username, password_hash) or None
+    return storage.get_user(username)  # (id, username, password_hash) or None
 
 def create_user(username, email, password):
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        cur = conn.cursor()
-        pw_hash = hash_password(password)
-        cur.execute("INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)", (username, email, pw_hash))
-        conn.commit()
-        conn.close()
-        return True
-    except sqlite3.IntegrityError:
-        return False
+    return storage.create_user(username, email, hash_password(password))
     
 def save_history(entry_type, input_text, detected_lang, target_lang, output_text, extra_blob=None):
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cur = conn.cursor()
-        ts = datetime.utcnow().isoformat()
         user_id = st.session_state.get("user_id")  # Set this after login
-        cur.execute(
-            "INSERT INTO history (user_id, timestamp, type, detected_lang, target_lang, input, output, extra) VALUES (?,?,?,?,?,?,?,?)",
-            (user_id, ts, entry_type, detected_lang, target_lang, input_text, output_text, extra_blob),
-        )
-        conn.commit()
-        conn.close()
+        history_writer.submit(user_id, entry_type, input_text, detected_lang, target_lang, output_text, extra_blob)
     except Exception:
         logging.exception("save_history failed")
 
-@st.cache_data
-def load_history_df():
+HISTORY_PAGE_SIZE = 50
+
+def _history_df(rows):
+    df = pd.DataFrame(rows, columns=HISTORY_COLUMNS)
+    if not df.empty:
+        df["timestamp"] = pd.to_datetime(df["timestamp"]).astype(str)
+    return df
+
+def load_history_page(user_id, entry_type=None, date_from=None, date_to=None, text=None, before_id=None, limit=HISTORY_PAGE_SIZE):
+    """One filtered page of history as (DataFrame, next_before_id)."""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        user_id = st.session_state.get("user_id")
-        df = pd.read_sql_query(
-            "SELECT * FROM history WHERE user_id=? ORDER BY id DESC",
-            conn,
-            params=(user_id,)
-        )
-        conn.close()
-        if not df.empty:
-            df["timestamp"] = pd.to_datetime(df["timestamp"]).astype(str)
-        return df
+        if entry_type or date_from or date_to or text:
+            rows, next_before = storage.query_history(user_id, entry_type, date_from, date_to, text, before_id, limit)
+        else:
+            rows, next_before = history_cache.page(user_id, before_id, limit)
+        return _history_df(rows), next_before
     except Exception:
-        logging.exception("load_history_df failed")
-        return pd.DataFrame(columns=["id","timestamp","type","detected_lang","target_lang","input","output"])
+        logging.exception("load_history_page failed")
+        return _history_df([]), None
+
+def load_history_all(user_id, **filters):
+    """Every row matching filters (walks the pages); used for exports only."""
+    frames, before_id = [], None
+    while True:
+        rows, before_id = storage.query_history(user_id, before_id=before_id, limit=1000, **filters)
+        frames.append(_history_df(rows))
+        if before_id is None:
+            return pd.concat(frames, ignore_index=True)
 
 def clear_history():
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cur = conn.cursor()
-        user_id = st.session_state.get("user_id")
-        cur.execute("DELETE FROM history WHERE user_id=?", (user_id,))
-        conn.commit()
-        conn.close()
+        history_writer.flush(timeout=5)  # don't let queued rows land after the clear
+        history_cache.clear_history(st.session_state.get("user_id"))
     except Exception:
         logging.exception("clear_history failed")
 
@@ -418,7 +397,6 @@ with tabs[0]:
                     output_area.text_area("Translation", value=translated, height=260, disabled=True, key="translated_result_area")
                     st.markdown(f'<div class="detected">Detected: <strong>{detected}</strong></div>', unsafe_allow_html=True)
                     save_history("text", input_text, detected, target_lang, translated)
-                    st.cache_data.clear()
         with action_cols[1]:
             if st.button("🔊 TTS", key="tts_button"):
                 txt = st.session_state.get("last_translated", "")
@@ -461,86 +439,141 @@ with tabs[1]:
     else:
         st.info("In-browser recorder not installed. Install: `pip install streamlit-audiorecorder` or upload audio files.")
 
+    spoken_lang = st.selectbox("Spoken language:", ["auto"] + list(SUPPORTED_SPEECH_LANGS.keys()),
+                               format_func=lambda x: "Auto-detect" if x == "auto" else SUPPORTED_SPEECH_LANGS[x], key="speech_source")
     target_lang_speech = st.selectbox("Translate to:", list(SUPPORTED_LANGS.keys()), format_func=lambda x: SUPPORTED_LANGS[x], key="speech_target")
     tts_speech = st.checkbox("🔊 Convert translation to speech (TTS) - speech tab")
 
     if st.button("Transcribe & Translate", key="translate_speech_btn"):
         file_obj = None
-        # normalize recorded_audio to a file-like object if present
-        if recorded_audio:
-            try:
-                if isinstance(recorded_audio, (bytes, bytearray)):
-                    file_obj = io.BytesIO(recorded_audio)
-                elif hasattr(recorded_audio, "getvalue"):
-                    file_obj = io.BytesIO(recorded_audio.getvalue())
-                else:
-                    # fallback: try to convert to bytes
-                    file_obj = io.BytesIO(bytes(recorded_audio))
-            except Exception:
-                file_obj = None
+        # the job queue accepts bytes, file-likes and recorder AudioSegments
+        if recorded_audio is not None and len(recorded_audio) > 0:
+            file_obj = recorded_audio
         elif audio_file:
             file_obj = audio_file
         else:
             st.warning("Please record or upload an audio file.")
 
         if file_obj:
-            with st.spinner("Transcribing audio..."):
+            try:
+                # Whisper can translate to English itself, saving the network round trip
+                task = "translate" if target_lang_speech == "en" and spoken_lang != "en" else "transcribe"
+                job_id = transcription_jobs.submit(file_obj, lang=spoken_lang, task=task)
+                st.session_state["speech_job"] = {"id": job_id, "target": target_lang_speech, "tts": tts_speech}
+                st.session_state.pop("speech_result", None)
+            except Exception as e:
+                st.error(f"Speech -> text failed: {e}")
+
+    # transcription runs in the worker pool; only this fragment reruns while it is polled,
+    # so the rest of the page stays responsive
+    @st.fragment(run_every=1.0 if st.session_state.get("speech_job") else None)
+    def speech_job_panel():
+        speech_job = st.session_state.get("speech_job")
+        if not speech_job:
+            return
+        job = transcription_jobs.status(speech_job["id"])
+        if job is not None and job["state"] not in FINISHED_JOB_STATES:
+            if st.button("Cancel transcription", key="cancel_speech_btn"):
+                transcription_jobs.cancel(speech_job["id"])
+            if job["state"] == "queued":
+                st.progress(0.0, text=f"Queued ({job['queue_position']} ahead)")
+            else:
+                st.progress(job["progress"] or 0.0, text=f"Transcribed {job['audio_seconds']:.0f}s of audio")
+                if job["text"]:
+                    st.write(job["text"])
+            return
+        del st.session_state["speech_job"]
+        target, result = speech_job["target"], {"target": speech_job["target"]}
+        if job is None:
+            result["warning"] = "Transcription job expired."
+        elif job["state"] == "cancelled":
+            result["info"] = "Transcription cancelled."
+        elif job["state"] == "error":
+            result["error"] = f"Speech -> text failed: {job['error']}"
+        elif job["text"]:
+            transcript = job["text"]
+            if job["task"] == "translate" and job["translation"]:
+                # Whisper produced the English text itself; history keeps the spoken-language transcript as input
+                translated, detected = job["translation"], job["language"]
+            else:
+                with st.spinner("Translating..."):
+                    # the language Whisper found is passed on, so translation skips detection
+                    translated, detected = detect_and_translate(transcript, target, source_lang=job["language"])
+            save_history("speech", transcript, detected, target, translated)
+            result.update(transcript=transcript, translated=translated)
+            if speech_job["tts"]:
                 try:
-                    transcript = speech_to_text(file_obj)
+                    result["audio"] = text_to_speech_bytes(translated, lang=target)
                 except Exception as e:
-                    st.error(f"Speech -> text failed: {e}")
-                    transcript = ""
-            if transcript:
-                st.write("**Transcribed:**", transcript)
-                with st.spinner("Translating..."):
-                    translated, detected = detect_and_translate(transcript, target_lang_speech)
-                st.success(f"Translated ({SUPPORTED_LANGS[target_lang_speech]}):")
-                st.write(translated)
-                save_history("speech", transcript, detected, target_lang_speech, translated)
-                st.cache_data.clear()
-                if tts_speech:
-                    try:
-                        audio_bytes = text_to_speech_bytes(translated, lang=target_lang_speech)
-                        st.audio(audio_bytes, format="audio/mp3")
-                        st.download_button("📥 Download Audio", data=audio_bytes, file_name="speech_translation.mp3", mime="audio/mpeg")
-                    except Exception as e:
-                        st.error(f"TTS failed: {e}")
+                    result["tts_error"] = f"TTS failed: {e}"
+        st.session_state["speech_result"] = result
+        st.rerun()  # full run: show the result and stop the fragment timer
+
+    speech_job_panel()
+
+    speech_result = st.session_state.get("speech_result")
+    if speech_result:
+        for level in ("warning", "info", "error"):
+            if speech_result.get(level):
+                getattr(st, level)(speech_result[level])
+        if speech_result.get("transcript"):
+            st.write("**Transcribed:**", speech_result["transcript"])
+            st.success(f"Translated ({SUPPORTED_LANGS[speech_result['target']]}):")
+            st.write(speech_result["translated"])
+        if speech_result.get("audio"):
+            st.audio(speech_result["audio"], format="audio/mp3")
+            st.download_button("📥 Download Audio", data=speech_result["audio"], file_name="speech_translation.mp3", mime="audio/mpeg")
+        if speech_result.get("tts_error"):
+            st.error(speech_result["tts_error"])
 
 # ---------------- IMAGE OCR TAB ----------------
 with tabs[2]:
     st.subheader("🖼️ OCR - Extract & Translate")
     image_files = st.file_uploader("Upload images", type=["png","jpg","jpeg"], accept_multiple_files=True)
     target_lang_ocr = st.selectbox("Translate to:", list(SUPPORTED_LANGS.keys()), format_func=lambda x: SUPPORTED_LANGS[x], key="ocr_target")
+    ocr_engine = st.selectbox("OCR engine", ["auto", "race", "tesseract", "easyocr"], key="ocr_engine",
+                              help="auto: Tesseract, easyocr as fallback • race: run both and keep the most confident result")
     if st.button("Extract & Translate (Images)", key="translate_images_btn"):
         if not image_files:
             st.warning("Please upload at least one image.")
         else:
             translated_images = []
             ocr_results = []
-            for idx, image_file in enumerate(image_files):
-                with st.spinner(f"Processing image {idx+1}/{len(image_files)}..."):
-                    extracted, boxes = extract_text_from_image(image_file)
+            # OCR, translation and rendering overlap across images; results stream in as each finishes
+            pipeline = OcrPipeline(target_lang=target_lang_ocr, engine=ocr_engine)
+            progress = st.progress(0.0, text=f"Processing {len(image_files)} image(s)...")
+            images = [(f.name, f.getvalue()) for f in image_files]
+            for done, res in enumerate(pipeline.run(images), start=1):
+                progress.progress(done / len(images), text=f"Processed {done}/{len(images)} images")
+                idx = res["index"]
+                st.markdown(f"**Image {idx+1}: {res['name']}**")
+                if res.get("error"):
+                    st.error(res["error"])
+                    st.divider()
+                    continue
+                extracted, translated = res["extracted"], res["translated"]
                 st.write(f"Extracted text: {extracted}")
+                if res["confidences"]:
+                    st.caption(f"Engine: {res['engine']} • mean confidence {sum(res['confidences']) / len(res['confidences']):.0%}")
                 st.write(extracted or "*No text detected*")
-                translated, detected = detect_and_translate(extracted, target_lang_ocr)
                 st.success(f"Translated ({SUPPORTED_LANGS[target_lang_ocr]}):")
                 st.write(translated or "*—*")
-                save_history("image", extracted, detected, target_lang_ocr, translated)
+                save_history("image", extracted, res["detected"], target_lang_ocr, translated)
 
-                translated_boxes = []
-                for bbox, text in boxes:
-                    ttxt, _ = detect_and_translate(text, target_lang_ocr)
-                    translated_boxes.append(ttxt)
-                img_with_boxes = draw_bounding_boxes(image_file.getvalue(), boxes, translated_boxes)
                 col1, col2 = st.columns(2)
-                with col1: st.image(image_file, caption=f"Original {idx+1}", width=350)
-                with col2: st.image(img_with_boxes, caption=f"Translated {idx+1}", width=350)
+                with col1: st.image(res["original_img"], caption=f"Original {idx+1}", width=350)
+                with col2: st.image(res["image"], caption=f"Translated {idx+1}", width=350)
 
-                img_bytes = io.BytesIO()
-                img_with_boxes.save(img_bytes, format="PNG")
-                translated_images.append((f"translated_{idx+1}.png", img_bytes.getvalue()))
-                ocr_results.append({"original_img": image_file.getvalue(), "translated_img": img_bytes.getvalue(), "extracted": extracted, "translated": translated})
+                translated_images.append((idx, f"translated_{idx+1}.png", res["translated_img"]))
+                ocr_results.append((idx, {"original_img": res["original_img"], "translated_img": res["translated_img"], "extracted": extracted, "translated": translated}))
                 st.divider()
+            progress.empty()
+            logging.info("ocr pipeline stats: %s", pipeline.stats)
+            with st.expander("Pipeline timings"):
+                st.json(pipeline.stats)
+            # downloads keep upload order
+            translated_images = [(fname, data) for _, fname, data in sorted(translated_images)]
+            ocr_results = [r for _, r in sorted(ocr_results, key=lambda x: x[0])]
 
             zip_buffer = io.BytesIO()
             with zipfile.ZipFile(zip_buffer, "w") as zipf:
@@ -550,57 +583,65 @@ with tabs[2]:
             st.download_button("📥 Download Translated Images (ZIP)", data=zip_buffer, file_name="translated_images.zip", mime="application/zip")
 
             if ocr_results:
-                pdf_path = export_ocr_pdf(ocr_results, output_path=str(APP_DIR / "ocr_report.pdf"))
-                with open(pdf_path, "rb") as f:
-                    b64 = base64.b64encode(f.read()).decode()
-                href = f'<a href="data:application/pdf;base64,{b64}" download="ocr_report.pdf">📥 Download OCR Report (PDF)</a>'
-                st.markdown(href, unsafe_allow_html=True)
+                # built in memory per request; nothing shared on disk between users
+                report_bytes = build_ocr_report(ocr_results)
+                st.download_button("📥 Download OCR Report (PDF)", data=report_bytes, file_name="ocr_report.pdf", mime="application/pdf")
 
 # ---------------- HISTORY TAB ----------------
 with tabs[3]:
     st.subheader("📜 Translation History")
-    df = load_history_df()
-    if df.empty:
+    user_id = st.session_state.get("user_id")
+    history_types = history_cache.types(user_id)
+    if not history_types:
         st.info("No history found yet.")
     else:
         st.markdown("**Filters**")
         cols = st.columns([2,2,2])
         with cols[0]:
-            ft_type = st.selectbox("Type", options=["All"] + sorted(df["type"].unique().tolist()))
+            ft_type = st.selectbox("Type", options=["All"] + history_types)
         with cols[1]:
-            ft_source = st.text_input("Search text contains...")
+            ft_source = st.text_input("Search text...", help="Matches any part of the input or output text (substring search)")
         with cols[2]:
             date_range = st.date_input("Date range", [])
 
-        df_display = df.copy()
-        if ft_type != "All": df_display = df_display[df_display["type"]==ft_type]
-        if ft_source:
-            mask = df_display["input"].str.contains(ft_source, case=False, na=False) | df_display["output"].str.contains(ft_source, case=False, na=False)
-            df_display = df_display[mask]
-        if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
-            start_dt = datetime.combine(date_range[0], datetime.min.time())
-            end_dt = datetime.combine(date_range[1], datetime.max.time())
-            df_display["ts_dt"] = pd.to_datetime(df_display["timestamp"])
-            df_display = df_display[(df_display["ts_dt"] >= start_dt) & (df_display["ts_dt"] <= end_dt)]
-            df_display = df_display.drop(columns=["ts_dt"])
-        elif isinstance(date_range, (list, tuple)) and len(date_range) == 1:
-            single_dt = datetime.combine(date_range[0], datetime.min.time())
-            df_display["ts_dt"] = pd.to_datetime(df_display["timestamp"])
-            df_display = df_display[df_display["ts_dt"].dt.date == single_dt.date()]
-            df_display = df_display.drop(columns=["ts_dt"])
+        # filters are applied in SQL; only the current page is loaded
+        filters = {"entry_type": None if ft_type == "All" else ft_type, "text": ft_source or None, "date_from": None, "date_to": None}
+        if isinstance(date_range, (list, tuple)) and len(date_range) in (1, 2):
+            filters["date_from"] = datetime.combine(date_range[0], datetime.min.time())
+            filters["date_to"] = datetime.combine(date_range[-1], datetime.max.time())
+
+        # keyset pagination: a stack of before_id cursors, reset whenever filters change
+        if st.session_state.get("hist_filters") != filters:
+            st.session_state["hist_filters"] = filters
+            st.session_state["hist_cursors"] = [None]
+        cursors = st.session_state["hist_cursors"]
+        df_display, next_before = load_history_page(user_id, before_id=cursors[-1], **filters)
+
         st.dataframe(df_display[["timestamp","type","detected_lang","target_lang","input","output"]], height=300)
+        p1, p2, p3 = st.columns([1,3,1])
+        with p1:
+            if st.button("◀ Newer", disabled=len(cursors) == 1):
+                cursors.pop()
+                st.rerun()
+        with p2:
+            st.caption(f"Page {len(cursors)}")
+        with p3:
+            if st.button("Older ▶", disabled=next_before is None):
+                cursors.append(next_before)
+                st.rerun()
+
         c1,c2,c3 = st.columns(3)
         with c1:
             if st.button("Export PDF"):
-                pdf_bytes = export_history_pdf_bytes(df_display)
+                pdf_bytes = export_history_pdf_bytes(load_history_all(user_id, **filters))
                 st.download_button("📥 Download PDF", data=pdf_bytes, file_name="translation_history.pdf", mime="application/pdf")
         with c2:
-            csv_bytes = df_display.to_csv(index=False).encode()
-            st.download_button("📥 Export CSV", data=csv_bytes, file_name="translation_history.csv", mime="text/csv")
+            if st.button("Export CSV"):
+                csv_bytes = load_history_all(user_id, **filters).to_csv(index=False).encode()
+                st.download_button("📥 Download CSV", data=csv_bytes, file_name="translation_history.csv", mime="text/csv")
         with c3:
             if st.button("Clear History"):
                 clear_history()
-                st.cache_data.clear()
                 st.success("History cleared.")
                 st.rerun()
 # ---------------- END OF APP ----------------
@@ -0,0 +1,168 @@
+# utils/migrations.py
+"""
+Versioned schema migrations for history.db.
+The applied version lives in PRAGMA user_version; migrate(conn) runs every
+newer step in order, each inside its own transaction.
+Append new steps to MIGRATIONS — never edit or reorder released ones.
+"""
+
+import logging
+
+
+def has_fts5(conn):
+    """True if this SQLite build ships the FTS5 extension."""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(x)")
+        conn.execute("DROP TABLE temp._fts5_probe")
+        return True
+    except Exception:
+        return False
+
+
+def has_trigram(conn):
+    """True if FTS5 has the trigram tokenizer (SQLite >= 3.34)."""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp._trigram_probe USING fts5(x, tokenize='trigram')")
+        conn.execute("DROP TABLE temp._trigram_probe")
+        return True
+    except Exception:
+        return False
+
+
+def _add_history_fts(conn, tokenize="unicode61 remove_diacritics 2"):
+    # external-content FTS index over history.input/output, kept in sync by triggers;
+    # skipped on builds without FTS5 (search then falls back to LIKE)
+    if not has_fts5(conn):
+        logging.warning("SQLite FTS5 unavailable; history search will use LIKE scans")
+        return
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5("
+        f"input, output, content='history', content_rowid='id', tokenize='{tokenize}')"
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS history_fts_ai AFTER INSERT ON history BEGIN
+            INSERT INTO history_fts(rowid, input, output) VALUES (new.id, new.input, new.output);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS history_fts_ad AFTER DELETE ON history BEGIN
+            INSERT INTO history_fts(history_fts, rowid, input, output) VALUES ('delete', old.id, old.input, old.output);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS history_fts_au AFTER UPDATE OF input, output ON history BEGIN
+            INSERT INTO history_fts(history_fts, rowid, input, output) VALUES ('delete', old.id, old.input, old.output);
+            INSERT INTO history_fts(rowid, input, output) VALUES (new.id, new.input, new.output);
+        END
+        """
+    )
+    # index rows written before this migration
+    conn.execute("INSERT INTO history_fts(history_fts) VALUES ('rebuild')")
+
+
+def _history_fts_trigram(conn):
+    # word tokens can't match inside words or in scripts written without spaces
+    # (CJK, Thai); trigrams keep substring semantics. Older builds keep unicode61.
+    if not has_fts5(conn) or not has_trigram(conn):
+        return
+    for trigger in ("history_fts_ai", "history_fts_ad", "history_fts_au"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS history_fts")
+    _add_history_fts(conn, tokenize="trigram")
+
+
+MIGRATIONS = [
+    # 1: base schema (IF NOT EXISTS so databases created before migrations are adopted)
+    (1, [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE,
+            email TEXT UNIQUE,
+            password_hash TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            timestamp TEXT,
+            type TEXT,
+            detected_lang TEXT,
+            target_lang TEXT,
+            input TEXT,
+            output TEXT,
+            extra BLOB,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        """,
+    ]),
+    # 2: indexes for per-user history listing and filtering
+    (2, [
+        "CREATE INDEX IF NOT EXISTS idx_history_user_id ON history(user_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_history_user_type ON history(user_id, type)",
+        "CREATE INDEX IF NOT EXISTS idx_history_user_ts ON history(user_id, timestamp)",
+        "ANALYZE",
+    ]),
+    # 3: full-text search over history input/output
+    (3, [_add_history_fts]),
+    # 4: substring-capable FTS (trigram tokenizer) where available
+    (4, [_history_fts_trigram]),
+    # 5: translation memory (utils/translation_cache.py); IF NOT EXISTS adopts tables
+    # that older versions created on first use
+    (5, [
+        """
+        CREATE TABLE IF NOT EXISTS translation_cache (
+            source_text TEXT,
+            source_lang TEXT,
+            target_lang TEXT,
+            backend TEXT,
+            translated TEXT,
+            detected_lang TEXT,
+            created_at REAL,
+            PRIMARY KEY (source_text, source_lang, target_lang, backend)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_tm_created ON translation_cache(created_at)",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Apply pending migrations. Returns the resulting schema version."""
+    version = current_version(conn)
+    for target, statements in MIGRATIONS:
+        if target <= version:
+            continue
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # re-check under the write lock: another process may have migrated meanwhile
+            if current_version(conn) >= target:
+                conn.execute("COMMIT")
+                version = target
+                continue
+            for step in statements:
+                # a step is either a SQL string or a callable(conn) for conditional work
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version={int(target)}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            logging.exception("migration %s failed", target)
+            raise
+        version = target
+    return version
@@ -2,10 +2,22 @@
 
 
 import textwrap
+import functools
 import io
+import hashlib
+import json
+import math
+import multiprocessing
+import shutil
 import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from PIL import Image, ImageDraw, ImageFont
 import os
+import fpdf
 from fpdf import FPDF
 
 # OCR libs (optional)
@@ -21,149 +33,920 @@ try:
     _HAS_EASYOCR = True
 except Exception:
     _HAS_EASYOCR = False
+
+try:
+    import numpy as np
+    _HAS_NUMPY = True
+except Exception:
+    _HAS_NUMPY = False
     
-def _save_image(uploaded_file):
-    """Save uploaded file (Streamlit UploadFile-like) to temporary path and return path."""
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-        tmp.write(uploaded_file.read())
-        return tmp.name
-    
-def extract_text_from_image(uploaded_file, lang="en"):
+# ---- easyocr reader pool ----
+# Building an easyocr.Reader loads detection + recognition networks, so readers
+# are kept warm per language set and shared by all sessions in the process.
+MAX_EASYOCR_READERS = int(os.environ.get("LINGUA_MAX_EASYOCR_READERS", "2"))
+
+_readers = OrderedDict()  # tuple(langs) -> easyocr.Reader, oldest first
+_readers_lock = threading.Lock()  # guards _readers only; never held while loading
+_reader_load_locks = {}  # tuple(langs) -> Lock, so one set loads at a time without blocking warm ones
+
+
+def get_easyocr_reader(langs):
+    """Return a cached easyocr.Reader for the given language(s), LRU-evicting beyond the cap."""
+    if not _HAS_EASYOCR:
+        raise RuntimeError("easyocr not installed. Run: pip install easyocr")
+    if isinstance(langs, str):
+        langs = [langs]
+    key = tuple(sorted(set(langs)))
+    with _readers_lock:
+        reader = _readers.get(key)
+        if reader is not None:
+            _readers.move_to_end(key)
+            return reader
+        load_lock = _reader_load_locks.setdefault(key, threading.Lock())
+    with load_lock:
+        with _readers_lock:
+            reader = _readers.get(key)  # another thread may have loaded it meanwhile
+        if reader is None:
+            reader = easyocr.Reader(list(key), gpu=False)
+    with _readers_lock:
+        _readers[key] = reader
+        _readers.move_to_end(key)
+        while len(_readers) > max(1, MAX_EASYOCR_READERS):
+            _readers.popitem(last=False)
+        return reader
+
+
+def clear_easyocr_readers():
+    """Drop all pooled readers (frees their model memory)."""
+    with _readers_lock:
+        _readers.clear()
+
+
+def _read_bytes(source):
+    """Raw bytes of an upload (bytes, BytesIO or UploadedFile-like)."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    return source.read()
+
+
+def decode_image(source):
     """
-    Extract text + bounding boxes from an uploaded image file.
-    Returns: (text, boxes) where boxes = [((x1,y1,w,h), text), ...]
+    Decode an image once, fully in memory.
+    source: bytes, a BytesIO / UploadedFile-like object, or an existing PIL.Image.
+    Returns an RGB PIL.Image (pixels loaded, no file handle kept open).
     """
-    path = _save_image(uploaded_file)
-    try:
-        img = Image.open(path)
-    except Exception as e:
-        raise RuntimeError("Could not open uploaded image.") from e
+    if isinstance(source, Image.Image):
+        img = source
+    else:
+        try:
+            img = Image.open(io.BytesIO(_read_bytes(source)))
+            img.load()
+        except Exception as e:
+            raise RuntimeError("Could not open uploaded image.") from e
+    return img if img.mode == "RGB" else img.convert("RGB")
+
+
+# ---- preprocessing ----
+# OCR cost grows with pixel count, and phone photos are far larger than text needs.
+# Settings: max_dim (longest side, 0 = keep), grayscale, binarize (Otsu), deskew.
+PREPROCESS = {
+    "max_dim": int(os.environ.get("LINGUA_OCR_MAX_DIM", "1600")),
+    "grayscale": os.environ.get("LINGUA_OCR_GRAYSCALE", "1") == "1",
+    "binarize": os.environ.get("LINGUA_OCR_BINARIZE", "0") == "1",
+    "deskew": os.environ.get("LINGUA_OCR_DESKEW", "0") == "1",
+}
+_DESKEW_MAX_ANGLE = 5.0
+_DESKEW_STEP = 0.5
+_DESKEW_MIN_GAIN = 1.05  # a tilt must beat 0° by 5% to be applied
+_DESKEW_MIN_STRUCTURE = 0.05  # below this the row profile has no text lines to align
+
+
+def _otsu_threshold(gray):
+    hist = gray.histogram()[:256]
+    total = sum(hist)
+    sum_all = sum(i * h for i, h in enumerate(hist))
+    best, threshold = -1.0, 127
+    weight_bg = sum_bg = 0
+    for t in range(256):
+        weight_bg += hist[t]
+        if weight_bg == 0:
+            continue
+        weight_fg = total - weight_bg
+        if weight_fg == 0:
+            break
+        sum_bg += t * hist[t]
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if between > best:
+            best, threshold = between, t
+    return threshold
+
+
+def _estimate_skew(gray):
+    """Projection-profile skew estimate in degrees (text lines give sharp row-sum peaks)."""
+    thumb = gray.copy()
+    thumb.thumbnail((600, 600))
+    cutoff = _otsu_threshold(thumb)
+    ink = thumb.point(lambda p: 255 if p < cutoff else 0)
+    # score only the centre that stays covered at every angle: the empty corners a
+    # rotation leaves would otherwise change the row sums of any textured image
+    w, h = ink.size
+    m = math.ceil((w + h) / 2 * math.sin(math.radians(_DESKEW_MAX_ANGLE)))
+    box = (m, m, w - m, h - m) if w > 2 * m and h > 2 * m else (0, 0, w, h)
+
+    def score(angle):
+        rotated = ink.rotate(angle, resample=Image.NEAREST).crop(box)
+        rows = np.asarray(rotated, dtype=np.float32).sum(axis=1)
+        mean = float(rows.mean())
+        # variance relative to the mean ink per row: ~1+ for text lines, ~0 for noise/gradients
+        return float(np.var(rows)) / (mean * mean) if mean else 0.0
+
+    level = score(0.0)
+    best_angle, best_score = 0.0, level
+    steps = int(_DESKEW_MAX_ANGLE / _DESKEW_STEP)
+    for i in range(-steps, steps + 1):
+        angle = i * _DESKEW_STEP
+        if angle:
+            s = score(angle)
+            if s > best_score:
+                best_angle, best_score = angle, s
+    # rotate only when there are line-like rows and the tilt clearly beats leaving
+    # the page as is (blank pages and photos without text stay untouched)
+    if best_score < _DESKEW_MIN_STRUCTURE or best_score <= level * _DESKEW_MIN_GAIN:
+        return 0.0
+    return best_angle
+
+
+def preprocess_image(img, max_dim=None, grayscale=None, binarize=None, deskew=None):
+    """
+    Prepare an image for OCR. Unset options fall back to PREPROCESS.
+    Returns (processed_img, transform); pass transform to map_box_to_original().
+    """
+    opts = dict(PREPROCESS)
+    opts.update({k: v for k, v in
+                 dict(max_dim=max_dim, grayscale=grayscale, binarize=binarize, deskew=deskew).items()
+                 if v is not None})
+    transform = {"scale": 1.0, "angle": 0.0, "size": img.size}
+    out = img
+    if opts["max_dim"] and max(img.size) > opts["max_dim"]:
+        scale = opts["max_dim"] / max(img.size)
+        new_size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        out = out.resize(new_size, Image.BILINEAR)
+        transform["scale"] = scale
+    if opts["grayscale"] or opts["binarize"] or opts["deskew"]:
+        out = out.convert("L")
+    if opts["deskew"] and _HAS_NUMPY:
+        angle = _estimate_skew(out)
+        if angle:
+            out = out.rotate(angle, resample=Image.BILINEAR, fillcolor=255)
+            transform["angle"] = angle
+            transform["processed_size"] = out.size
+    if opts["binarize"]:
+        cutoff = _otsu_threshold(out)
+        out = out.point(lambda p: 255 if p > cutoff else 0)
+    return out, transform
+
+
+def map_box_to_original(bbox, transform):
+    """Map an (x, y, w, h) box from preprocessed coordinates back to the original image."""
+    x, y, w, h = bbox
+    corners = [(x, y), (x + w, y), (x, y + h), (x + w, y + h)]
+    angle = transform.get("angle", 0.0)
+    if angle:
+        # PIL rotates counter-clockwise about the centre; undo it
+        cx, cy = transform["processed_size"][0] / 2, transform["processed_size"][1] / 2
+        rad = math.radians(angle)
+        cos, sin = math.cos(rad), math.sin(rad)
+        corners = [
+            (cx + (px - cx) * cos - (py - cy) * sin, cy + (px - cx) * sin + (py - cy) * cos)
+            for px, py in corners
+        ]
+    scale = transform.get("scale", 1.0)
+    xs = [px / scale for px, _ in corners]
+    ys = [py / scale for _, py in corners]
+    width, height = transform["size"]
+    x1, y1 = max(0, int(min(xs))), max(0, int(min(ys)))
+    x2, y2 = min(width, int(math.ceil(max(xs)))), min(height, int(math.ceil(max(ys))))
+    return x1, y1, max(0, x2 - x1), max(0, y2 - y1)
+
+
+# ---- word grouping ----
+# Tesseract reports one box per word plus block/paragraph/line numbers. Merging
+# words that share a line (or paragraph/block) means fewer boxes to translate and
+# draw, and the translator sees whole phrases instead of isolated words.
+OCR_GROUP = os.environ.get("LINGUA_OCR_GROUP", "line")
+_GROUP_KEYS = {
+    "word": ("block_num", "par_num", "line_num", "word_num"),
+    "line": ("block_num", "par_num", "line_num"),
+    "paragraph": ("block_num", "par_num"),
+    "block": ("block_num",),
+}
+
+
+def _group_words(data, group=None):
+    """group_tesseract_words() plus a mean word confidence (0-1) per merged box."""
+    keys = _GROUP_KEYS.get(group or OCR_GROUP, _GROUP_KEYS["line"])
+    groups = OrderedDict()  # group key -> [x1, y1, x2, y2, [words], [confs]]
+    confs = data.get("conf")
+    for i, raw in enumerate(data.get("text", [])):
+        txt = (raw or "").strip()
+        if not txt:
+            continue
+        # page_num keeps multi-page inputs apart; data without a level column groups per word
+        key = tuple(data[k][i] if k in data else i for k in ("page_num",) + keys)
+        x, y, w, h = data["left"][i], data["top"][i], data["width"][i], data["height"][i]
+        try:
+            conf = max(0.0, float(confs[i])) / 100 if confs else 0.0
+        except (TypeError, ValueError):
+            conf = 0.0
+        g = groups.get(key)
+        if g is None:
+            groups[key] = [x, y, x + w, y + h, [txt], [conf]]
+        else:
+            g[0], g[1] = min(g[0], x), min(g[1], y)
+            g[2], g[3] = max(g[2], x + w), max(g[3], y + h)
+            g[4].append(txt)
+            g[5].append(conf)
+    return [
+        ((x1, y1, x2 - x1, y2 - y1), " ".join(words), sum(cs) / len(cs))
+        for x1, y1, x2, y2, words, cs in groups.values()
+    ]
+
+
+def group_tesseract_words(data, group=None):
+    """
+    Merge pytesseract image_to_data() words into boxes at the given level
+    (word / line / paragraph / block). Returns [((x,y,w,h), text), ...] in reading order.
+    """
+    return [(bbox, txt) for bbox, txt, _ in _group_words(data, group)]
+
 
+# ---- engines ----
+# OCR_ENGINE picks the strategy:
+#   auto      - Tesseract, easyocr only if Tesseract fails or finds nothing
+#   tesseract / easyocr - a single engine
+#   race      - both concurrently; a confident first finisher wins outright,
+#               otherwise results are merged box-by-box by confidence within the budget
+OCR_ENGINE = os.environ.get("LINGUA_OCR_ENGINE", "auto")
+RACE_BUDGET_SECONDS = float(os.environ.get("LINGUA_OCR_RACE_BUDGET", "15"))
+RACE_GOOD_ENOUGH = 0.85  # mean confidence that lets the first finisher skip waiting
+MIN_BOX_CONFIDENCE = 0.30  # unmatched boxes below this are dropped when merging
+
+_engine_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ocr-engine")
+
+
+def _tesseract_detect(img, lang, group=None):
+    """[(bbox, text, conf)] from Tesseract (accepts the PIL image directly)."""
+    data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT, lang=lang)
+    return _group_words(data, group)
+
+
+def _easyocr_detect(img, lang):
+    """[(bbox, text, conf)] from easyocr (reads a numpy array, no file round trip)."""
+    reader = get_easyocr_reader(lang)
     results = []
-    text_out = ""
+    for quad, text, conf in reader.readtext(np.asarray(img)):
+        xs = [pt[0] for pt in quad]
+        ys = [pt[1] for pt in quad]
+        x_min, y_min = int(min(xs)), int(min(ys))
+        results.append(((x_min, y_min, int(max(xs)) - x_min, int(max(ys)) - y_min), text, float(conf)))
+    return results
+
+
+def _mean_confidence(boxes):
+    """Text-length weighted mean confidence."""
+    total = sum(len(txt) for _, txt, _ in boxes)
+    return sum(len(txt) * conf for _, txt, conf in boxes) / total if total else 0.0
+
+
+def _iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+def merge_by_confidence(*box_lists, min_iou=0.3):
+    """
+    Merge [(bbox, text, conf)] lists from several engines: overlapping boxes keep the
+    most confident reading; unmatched boxes are kept if above MIN_BOX_CONFIDENCE.
+    """
+    candidates = sorted((b for boxes in box_lists for b in boxes), key=lambda b: -b[2])
+    kept = []
+    for box in candidates:
+        if any(_iou(box[0], k[0]) >= min_iou for k in kept):
+            continue
+        if box[2] >= MIN_BOX_CONFIDENCE:
+            kept.append(box)
+    # reading order: top to bottom, then left to right
+    return sorted(kept, key=lambda b: (b[0][1], b[0][0]))
+
+
+def _race_engines(img, lang, group):
+    start = time.monotonic()
+    futures = {
+        _engine_pool.submit(_tesseract_detect, img, lang, group): "tesseract",
+        _engine_pool.submit(_easyocr_detect, img, lang): "easyocr",
+    }
+    finished = {}
+    pending = set(futures)
+    while pending:
+        remaining = RACE_BUDGET_SECONDS - (time.monotonic() - start)
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for fut in done:
+            try:
+                boxes = fut.result()
+            except Exception:
+                continue
+            if boxes:
+                finished[futures[fut]] = boxes
+                if _mean_confidence(boxes) >= RACE_GOOD_ENOUGH:
+                    # clearly good enough: don't wait for the slower engine
+                    return boxes, futures[fut]
+    for fut in pending:
+        fut.cancel()  # no-op once running; the late result is simply ignored
+    if not finished:
+        return [], None
+    if len(finished) == 1:
+        engine, boxes = next(iter(finished.items()))
+        return boxes, engine
+    return merge_by_confidence(*finished.values()), "merged"
+
+
+def _run_engines(img, lang, group=None, engine=None):
+    """Returns ([(bbox, text, conf)], engine_used). Boxes are in img's coordinates."""
+    engine = engine or OCR_ENGINE
+    if engine == "race" and _HAS_TESSERACT and _HAS_EASYOCR:
+        return _race_engines(img, lang, group)
 
     # pytesseract approach: uses image_to_data
-    if _HAS_TESSERACT:
+    if _HAS_TESSERACT and engine in ("auto", "tesseract", "race"):
         try:
-            data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT, lang=lang)
-            n = len(data.get("text", []))
-            for i in range(n):
-                txt = data["text"][i].strip()
-                if txt:
-                    x, y, w, h = data["left"][i], data["top"][i], data["width"][i], data["height"][i]
-                    results.append(((x, y, w, h), txt))
-                    text_out += txt + " "
+            results = _tesseract_detect(img, lang, group)
             if results:
-                os.unlink(path)
-                return text_out.strip(), results
+                return results, "tesseract"
         except Exception:
             pass
 
     # easyocr fallback
-    if _HAS_EASYOCR:
+    if _HAS_EASYOCR and engine in ("auto", "easyocr", "race"):
         try:
-            reader = easyocr.Reader([lang], gpu=False)
-            detections = reader.readtext(path)
-            for bbox, text, conf in detections:
-                (x_min, y_min), (x_max, y_max) = bbox[0], bbox[2]
-                w, h = x_max - x_min, y_max - y_min
-                results.append(((int(x_min), int(y_min), int(w), int(h)), text))
-                text_out += text + " "
+            results = _easyocr_detect(img, lang)
             if results:
-                os.unlink(path)
-                return text_out.strip(), results
+                return results, "easyocr"
         except Exception:
             pass
 
     # nothing found
+    return [], None
+
+
+def ocr_image_detailed(img, lang="en", preprocess=None, group=None, engine=None):
+    """
+    Like ocr_image() but also reports per-box confidences (0-1) and the engine used.
+    Returns {"text", "boxes": [((x,y,w,h), text), ...], "confidences": [...], "engine"}.
+    """
+    if preprocess is False:
+        transform = None
+    else:
+        img, transform = preprocess_image(img, **(preprocess or {}))
+    found, used = _run_engines(img, lang, group, engine)
+    remap = transform and (transform["scale"] != 1.0 or transform["angle"])
+    boxes = [(map_box_to_original(bbox, transform) if remap else bbox, txt) for bbox, txt, _ in found]
+    return {
+        "text": " ".join(txt for _, txt in boxes).strip(),
+        "boxes": boxes,
+        "confidences": [round(conf, 3) for _, _, conf in found],
+        "engine": used,
+    }
+
+
+def ocr_image(img, lang="en", preprocess=None, group=None, engine=None):
+    """
+    Run OCR on an already-decoded PIL.Image.
+    preprocess: dict of preprocess_image() options (None = PREPROCESS, False = skip).
+    group: Tesseract box level, word/line/paragraph/block (None = OCR_GROUP).
+    engine: auto / tesseract / easyocr / race (None = OCR_ENGINE).
+    Returns: (text, boxes) where boxes = [((x1,y1,w,h), text), ...] in original image coordinates
+    """
+    res = ocr_image_detailed(img, lang, preprocess, group, engine)
+    return res["text"], res["boxes"]
+
+
+# ---- OCR result cache ----
+# Re-uploaded screenshots are common; results are stored on disk as JSON keyed by
+# the image's content hash plus every setting that changes the output.
+OCR_CACHE_DIR = os.environ.get("LINGUA_OCR_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "lingua", "ocr"))
+OCR_CACHE_MAX_BYTES = int(float(os.environ.get("LINGUA_OCR_CACHE_MB", "64")) * 1024 * 1024)
+OCR_CACHE_ENABLED = os.environ.get("LINGUA_OCR_CACHE", "1") == "1"
+_CACHE_RESCAN_EVERY = 256  # puts between full walks of the cache directory
+_cache_lock = threading.Lock()
+_cache_bytes = None  # running size total; None until the first walk
+_cache_puts = 0
+
+
+def ocr_cache_key(image_bytes, lang="en", preprocess=None, group=None, engine=None):
+    """Content hash + engine + language + resolved preprocessing/grouping settings."""
+    if preprocess is False:
+        settings = "none"
+    else:
+        settings = dict(PREPROCESS)
+        settings.update({k: v for k, v in (preprocess or {}).items() if v is not None})
+    meta = json.dumps([engine or OCR_ENGINE, lang, settings, group or OCR_GROUP], sort_keys=True)
+    h = hashlib.sha256(image_bytes)
+    h.update(meta.encode())
+    return h.hexdigest()
+
+
+def _cache_path(key):
+    return os.path.join(OCR_CACHE_DIR, key[:2], key + ".json")
+
+
+def ocr_cache_get(key):
+    """Cached ocr_image_detailed() result or None."""
+    path = _cache_path(key)
+    try:
+        with open(path, encoding="utf-8") as f:
+            entry = json.load(f)
+        os.utime(path)  # mtime doubles as last-access time for eviction
+    except Exception:
+        return None
+    boxes = [(tuple(bbox), txt) for bbox, txt in entry["boxes"]]
+    return {
+        "text": entry["text"],
+        "boxes": boxes,
+        "confidences": entry.get("confidences") or [0.0] * len(boxes),
+        "engine": entry.get("engine"),
+    }
+
+
+def ocr_cache_put(key, result):
+    path = _cache_path(key)
     try:
-        os.unlink(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write-then-rename so concurrent workers never read a partial file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(dict(result, boxes=[[list(bbox), txt] for bbox, txt in result["boxes"]]), f)
+        os.replace(tmp, path)
+        size = os.path.getsize(path)
     except Exception:
-        pass
-    return "", [] 
+        return
+    _note_cache_write(size)
+
+
+def _note_cache_write(size):
+    """Add a write to the running size total; only walk the cache when it may be over the cap."""
+    global _cache_bytes, _cache_puts
+    with _cache_lock:
+        _cache_puts += 1
+        if _cache_bytes is None or _cache_puts % _CACHE_RESCAN_EVERY == 0:
+            scan = True  # first write, or periodic resync (other processes write here too)
+        else:
+            _cache_bytes += size
+            scan = _cache_bytes > OCR_CACHE_MAX_BYTES
+    if scan:
+        _evict_ocr_cache()
+
+
+def _evict_ocr_cache():
+    """Delete least recently used entries until the cache fits OCR_CACHE_MAX_BYTES, and resync the size total."""
+    global _cache_bytes
+    entries, total = [], 0
+    for root, _, files in os.walk(OCR_CACHE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    if total > OCR_CACHE_MAX_BYTES:
+        # trim below the cap so the next few writes don't trigger another walk
+        target = int(OCR_CACHE_MAX_BYTES * 0.9)
+        for _, size, path in sorted(entries):
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= target:
+                break
+    with _cache_lock:
+        _cache_bytes = total
+
+
+def clear_ocr_cache():
+    """Remove every cached OCR result."""
+    global _cache_bytes
+    shutil.rmtree(OCR_CACHE_DIR, ignore_errors=True)
+    with _cache_lock:
+        _cache_bytes = 0
+
+
+def _cached_ocr(image_bytes, lang, preprocess, group, engine=None):
+    """ocr_image_detailed() through the disk cache; the image is decoded only on a miss."""
+    key = ocr_cache_key(image_bytes, lang, preprocess, group, engine) if OCR_CACHE_ENABLED else None
+    if key:
+        hit = ocr_cache_get(key)
+        if hit is not None:
+            return hit
+    img = decode_image(image_bytes)
+    result = ocr_image_detailed(img, lang=lang, preprocess=preprocess, group=group, engine=engine)
+    # empty results aren't stored: they may just mean no engine was installed yet
+    if key and result["boxes"]:
+        ocr_cache_put(key, result)
+    return result
+
+
+def extract_text_from_image(uploaded_file, lang="en", preprocess=None, group=None, engine=None):
+    """
+    Extract text + bounding boxes from an uploaded image file.
+    Returns: (text, boxes) where boxes = [((x1,y1,w,h), text), ...]
+    """
+    result = _cached_ocr(_read_bytes(uploaded_file), lang, preprocess, group, engine)
+    return result["text"], result["boxes"]
+
+
+# ---- overlay rendering ----
+# Fonts are resolved once per process and cached per size; every box is drawn onto
+# one transparent RGBA layer that is alpha-composited over the image in a single pass.
+FONT_CANDIDATES = [p for p in [os.environ.get("LINGUA_OCR_FONT")] if p] + [
+    "arial.ttf",
+    "DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "LiberationSans-Regular.ttf",
+]
+MIN_FONT_SIZE = 10
+MAX_FONT_SIZE = 48
+BOX_OUTLINE = (255, 0, 0, 255)
+TEXT_BACKGROUND = (0, 0, 0, 160)
+TEXT_FILL = (255, 255, 0, 255)
+_PADDING = 4
+
+
+@functools.lru_cache(maxsize=1)
+def _font_path():
+    for path in FONT_CANDIDATES:
+        try:
+            ImageFont.truetype(path, MIN_FONT_SIZE)
+            return path
+        except Exception:
+            continue
+    return None
+
+
+@functools.lru_cache(maxsize=64)
+def get_font(size):
+    """Cached font at the given pixel size (Pillow's built-in font if no TTF is found)."""
+    path = _font_path()
+    if path:
+        return ImageFont.truetype(path, size)
+    try:
+        return ImageFont.load_default(size=size)  # Pillow >= 10.1
+    except TypeError:
+        return ImageFont.load_default()
+
+
+_measure = ImageDraw.Draw(Image.new("L", (1, 1)))  # scratch surface for text metrics
+
+
+@functools.lru_cache(maxsize=4096)
+def _fit_text(text, w, h):
+    """Largest font (and wrapping) whose text block fits a w x h box; returns (font, wrapped, bbox)."""
+    inner_w, inner_h = max(1, w - 2 * _PADDING), max(1, h - 2 * _PADDING)
+    # start near the size at which the text's area (~0.55em x 1.2em per glyph) fills the box
+    by_area = math.sqrt(inner_w * inner_h / (0.66 * max(1, len(text))))
+    size = max(MIN_FONT_SIZE, min(MAX_FONT_SIZE, int(h * 0.8), int(by_area)))
+    while True:
+        font = get_font(size)
+        wrapped = textwrap.fill(text, width=max(1, int(inner_w / (size * 0.55))))
+        bbox = _measure.multiline_textbbox((0, 0), wrapped, font=font)
+        fits = bbox[2] - bbox[0] <= inner_w and bbox[3] - bbox[1] <= inner_h
+        if fits or size <= MIN_FONT_SIZE:
+            return font, wrapped, bbox
+        size = max(MIN_FONT_SIZE, int(size * 0.85))
+
+
 def draw_bounding_boxes(image_bytes, boxes, translated_boxes):
     """
     Draw bounding boxes and overlay translated text on image.
-    - image_bytes: raw bytes or BytesIO
+    - image_bytes: raw bytes, BytesIO, or an already-decoded PIL.Image (left untouched)
     - boxes: list of ((x,y,w,h), original_text)
     - translated_boxes: list of translated text (matching order)
     Returns PIL.Image
     """
-    # open image
-    if isinstance(image_bytes, bytes):
-        img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    if isinstance(image_bytes, Image.Image):
+        base = image_bytes
     else:
-        # BytesIO-like
-        img = Image.open(image_bytes).convert("RGB")
-
-    draw = ImageDraw.Draw(img)
-   
-    try:
-        font = ImageFont.truetype("arial.ttf", 18)
-    except Exception:
-        font = ImageFont.load_default()
+        base = decode_image(image_bytes)
 
+    overlay = Image.new("RGBA", base.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
     for (bbox, original_text), translated_text in zip(boxes, translated_boxes):
         x1, y1, w, h = bbox
-        x2, y2 = x1 + w, y1 + h
-        draw.rectangle([x1, y1, x2, y2], outline=(255,0,0), width=2)
-        # wrap text to fit inside width
-        max_chars = max(10, w // 8)
-        wrapped = textwrap.fill(translated_text or "", width=max_chars)
-        # background rectangle for readability
-        text_size = draw.multiline_textsize(wrapped, font=font)
-        padding = 4
-        rect_x2 = x1 + text_size[0] + padding*2
-        rect_y2 = y1 + text_size[1] + padding*2
-        draw.rectangle([x1, y1 - padding, rect_x2, rect_y2 - padding], fill=(0,0,0,160))
-        draw.multiline_text((x1+padding, y1+padding), wrapped, fill=(255,255,0), font=font)
-    return img
-
-def export_ocr_pdf(ocr_results, output_path="ocr_report.pdf"):
-    """
-    ocr_results: list of dicts with keys:
-      - original_img (bytes)
-      - translated_img (bytes)
-      - extracted (str)
-      - translated (str)
-    Produces a simple PDF report with images and texts.
-    """
-    pdf = FPDF()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    for res in ocr_results:
-        pdf.add_page()
-        pdf.set_font("Arial", "B", 12)
-        pdf.cell(0, 8, "OCR Result", ln=True)
-        pdf.ln(4)
-        # Insert original image
-        try:
-            # save temp
-            tmp_in = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-            tmp_in.write(res["original_img"])
-            tmp_in.flush()
-            tmp_in.close()
-            pdf.image(tmp_in.name, w=90)
-            os.unlink(tmp_in.name)
-        except Exception:
-            pass
-        pdf.set_xy(110, 20)
-        pdf.set_font("Arial", size=10)
-        extracted = (res.get("extracted") or "")[:1000]
-        pdf.multi_cell(0, 6, f"Extracted: {extracted}")
-        pdf.ln(3)
-        # Insert translated image
-        try:
-            tmp_out = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-            tmp_out.write(res["translated_img"])
-            tmp_out.flush()
-            tmp_out.close()
-            pdf.image(tmp_out.name, w=90)
-            os.unlink(tmp_out.name)
-        except Exception:
-            pass
-        pdf.ln(4)
-        translated = (res.get("translated") or "")[:1000]
-        pdf.multi_cell(0, 6, f"Translated: {translated}")
-    pdf.output(output_path)
+        draw.rectangle([x1, y1, x1 + w, y1 + h], outline=BOX_OUTLINE, width=2)
+        if not translated_text:
+            continue
+        font, wrapped, (tx1, ty1, tx2, ty2) = _fit_text(translated_text, w, h)
+        # background sized to the text block, for readability
+        draw.rectangle(
+            [x1, y1, x1 + (tx2 - tx1) + 2 * _PADDING, y1 + (ty2 - ty1) + 2 * _PADDING],
+            fill=TEXT_BACKGROUND,
+        )
+        draw.multiline_text((x1 + _PADDING - tx1, y1 + _PADDING - ty1), wrapped, fill=TEXT_FILL, font=font)
+    return Image.alpha_composite(base.convert("RGBA"), overlay).convert("RGB")
+
+
+# ---- OCR PDF report ----
+# fpdf2 takes image streams and writes to file-like objects directly; legacy
+# PyFPDF (1.x) can only read images from paths, so it gets a private temp dir
+# that is always removed.
+_FPDF2 = int(str(getattr(fpdf, "FPDF_VERSION", "1")).split(".")[0]) >= 2
+REPORT_MAX_IMAGE_PX = int(os.environ.get("LINGUA_REPORT_MAX_IMAGE_PX", "1200"))
+
+
+def _report_image(data, max_px):
+    """Image bytes for the report, optionally downsampled and re-encoded as JPEG."""
+    if not max_px:
+        return data, "png"
+    img = decode_image(data)
+    if max(img.size) > max_px:
+        img.thumbnail((max_px, max_px), Image.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85, optimize=True)
+    return buf.getvalue(), "jpg"
+
+
+def _pdf_text(text, limit=1000):
+    # core PDF fonts are latin-1 only; replace what they can't encode instead of failing
+    return (text or "")[:limit].encode("latin-1", "replace").decode("latin-1")
+
+
+def build_ocr_report(ocr_results, out=None, max_image_px=None):
+    """
+    Build the OCR PDF report in memory.
+    ocr_results: list of dicts with keys original_img (bytes), translated_img (bytes),
+    extracted (str), translated (str).
+    max_image_px: longest side of embedded images (None = REPORT_MAX_IMAGE_PX, 0 = original PNGs).
+    Writes to out (a binary file-like object) if given and returns it; otherwise returns bytes.
+    """
+    if max_image_px is None:
+        max_image_px = REPORT_MAX_IMAGE_PX
+    tmpdir = None if _FPDF2 else tempfile.TemporaryDirectory(prefix="lingua_report_")
+    try:
+        pdf = FPDF()
+        pdf.set_auto_page_break(auto=True, margin=15)
+
+        def add_image(data, name):
+            try:
+                payload, ext = _report_image(data, max_image_px)
+                if tmpdir is None:
+                    pdf.image(io.BytesIO(payload), w=90)
+                else:
+                    path = os.path.join(tmpdir.name, f"{name}.{ext}")
+                    with open(path, "wb") as f:
+                        f.write(payload)
+                    pdf.image(path, w=90)
+            except Exception:
+                pass
+
+        for i, res in enumerate(ocr_results):
+            pdf.add_page()
+            pdf.set_font("Helvetica", "B", 12)
+            pdf.cell(0, 8, "OCR Result", ln=True)
+            pdf.ln(4)
+            add_image(res["original_img"], f"{i}_in")
+            pdf.set_xy(110, 20)
+            pdf.set_font("Helvetica", size=10)
+            pdf.multi_cell(0, 6, f"Extracted: {_pdf_text(res.get('extracted'))}")
+            pdf.ln(3)
+            add_image(res["translated_img"], f"{i}_out")
+            pdf.ln(4)
+            pdf.multi_cell(0, 6, f"Translated: {_pdf_text(res.get('translated'))}")
+
+        if _FPDF2:
+            data = bytes(pdf.output())
+        else:
+            data = pdf.output(dest="S").encode("latin-1")
+    finally:
+        if tmpdir is not None:
+            tmpdir.cleanup()
+    if out is None:
+        return data
+    out.write(data)
+    return out
+
+
+def export_ocr_pdf(ocr_results, output_path="ocr_report.pdf", max_image_px=None):
+    """Write the OCR report to output_path (see build_ocr_report) and return the path."""
+    with open(output_path, "wb") as f:
+        build_ocr_report(ocr_results, out=f, max_image_px=max_image_px)
     return output_path
-    
\ No newline at end of file
+
+
+# ---- pipelined batch OCR ----
+# OCR is CPU bound and runs in a process pool; translation is network bound and
+# runs in a thread pool; rendering (draw + PNG encode) gets its own threads.
+# Each image moves to the next stage as soon as it is ready, so the stages overlap.
+OCR_WORKERS = int(os.environ.get("LINGUA_OCR_WORKERS", str(min(2, os.cpu_count() or 1))))
+TRANSLATE_WORKERS = int(os.environ.get("LINGUA_TRANSLATE_WORKERS", "4"))
+RENDER_WORKERS = int(os.environ.get("LINGUA_RENDER_WORKERS", "2"))
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool(kind):
+    """Process-wide executors, created on first use and reused across reruns."""
+    with _pools_lock:
+        pool = _pools.get(kind)
+        if pool is None:
+            if kind == "ocr":
+                try:
+                    # spawn, not fork: forking the threaded Streamlit server can copy a held lock
+                    # (logging, reader/model registries) into the child and deadlock it
+                    pool = ProcessPoolExecutor(max_workers=max(1, OCR_WORKERS),
+                                               mp_context=multiprocessing.get_context("spawn"))
+                except Exception:
+                    # no multiprocessing available (restricted hosts): fall back to threads
+                    pool = ThreadPoolExecutor(max_workers=max(1, OCR_WORKERS), thread_name_prefix="ocr")
+            else:
+                workers = TRANSLATE_WORKERS if kind == "translate" else RENDER_WORKERS
+                pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=kind)
+            _pools[kind] = pool
+        return pool
+
+
+def _discard_pool(kind, pool):
+    """Forget a broken pool (a worker died, e.g. OOM) so the next _pool() call builds a new one."""
+    with _pools_lock:
+        if _pools.get(kind) is pool:
+            del _pools[kind]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _ocr_stage(image_bytes, lang, preprocess=None, group=None, engine=None):
+    # runs in a worker process: must be module-level and take picklable arguments.
+    # The pipeline deliberately decodes twice on a cache miss (here, then again in the
+    # render thread): only the small OCR result crosses the process pipe, because a
+    # pickled full-size bitmap (~36 MB for 12 MP) costs far more than a second decode.
+    start = time.perf_counter()
+    result = _cached_ocr(image_bytes, lang, preprocess, group, engine)
+    return result, time.perf_counter() - start
+
+
+def _translate_stage(translate_fn, extracted, boxes, target_lang):
+    start = time.perf_counter()
+    # whole text + every box in one batched call
+    batch = translate_fn([extracted] + [text for _, text in boxes], target_lang)
+    return batch, time.perf_counter() - start
+
+
+def _render_stage(image_bytes, boxes, translated_boxes):
+    start = time.perf_counter()
+    img = draw_bounding_boxes(image_bytes, boxes, translated_boxes)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return img, buf.getvalue(), time.perf_counter() - start
+
+
+class OcrPipeline:
+    """
+    Streams OCR -> translate -> render over many images.
+
+        pipeline = OcrPipeline(target_lang="es")
+        for res in pipeline.run([(name, image_bytes), ...]):
+            ...  # results arrive in completion order; res["index"] gives input order
+        pipeline.stats  # per-stage busy time and throughput
+
+    Each result dict has: index, name, original_img, extracted, boxes, confidences,
+    engine, translated, detected, translated_boxes, image (PIL), translated_img
+    (PNG bytes), timings, and error (str) when a stage failed.
+    """
+
+    STAGES = ("ocr", "translate", "render")
+
+    def __init__(self, target_lang="en", lang="en", translate_fn=None, preprocess=None, group=None, engine=None):
+        if translate_fn is None:
+            from utils.translator import translate_batch as translate_fn
+        self.target_lang = target_lang
+        self.lang = lang
+        self.translate_fn = translate_fn
+        self.preprocess = preprocess  # preprocess_image() options, None = PREPROCESS
+        self.group = group  # Tesseract box level, None = OCR_GROUP
+        self.engine = engine  # OCR engine strategy, None = OCR_ENGINE
+        self.stats = {}
+
+    def _record(self, stage, seconds):
+        entry = self.stats[stage]
+        entry["images"] += 1
+        entry["busy_seconds"] += seconds
+
+    def _finish_stats(self, wall):
+        for stage in self.STAGES:
+            e = self.stats[stage]
+            e["per_second"] = round(e["images"] / e["busy_seconds"], 2) if e["busy_seconds"] else 0.0
+            e["busy_seconds"] = round(e["busy_seconds"], 3)
+        done = self.stats["render"]["images"]
+        self.stats["wall_seconds"] = round(wall, 3)
+        self.stats["images_per_second"] = round(done / wall, 2) if wall else 0.0
+
+    @staticmethod
+    def _failed(res, error):
+        res["error"] = error
+        res.setdefault("extracted", "")
+        res.setdefault("boxes", [])
+        res.setdefault("translated", "")
+        res.setdefault("detected", "unknown")
+        res.setdefault("translated_boxes", [])
+        res["image"], res["translated_img"] = None, b""
+        return res
+
+    def run(self, images):
+        """images: iterable of (name, bytes). Yields one result dict per image."""
+        self.stats = {stage: {"images": 0, "busy_seconds": 0.0} for stage in self.STAGES}
+        started = time.perf_counter()
+        results = {}
+        pending = {}  # future -> (stage, index)
+        retried = set()  # images already resubmitted after a worker crash
+        owner = {}  # OCR future -> the pool it was submitted to
+
+        def submit_ocr(idx):
+            data = results[idx]["original_img"]
+            for attempt in range(2):
+                pool = _pool("ocr")
+                try:
+                    fut = pool.submit(_ocr_stage, data, self.lang, self.preprocess, self.group, self.engine)
+                except BrokenProcessPool:
+                    _discard_pool("ocr", pool)
+                    continue
+                owner[fut] = pool
+                pending[fut] = ("ocr", idx)
+                return None
+            return "ocr failed: worker pool unavailable"
+
+        failed = []
+        for idx, (name, data) in enumerate(images):
+            results[idx] = {"index": idx, "name": name, "original_img": data, "timings": {}}
+            error = submit_ocr(idx)
+            if error:
+                failed.append((idx, error))
+        for idx, error in failed:
+            yield self._failed(results.pop(idx), error)
+
+        while pending:
+            finished, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for fut in finished:
+                stage, idx = pending.pop(fut)
+                res = results[idx]
+                try:
+                    out = fut.result()
+                except BrokenProcessPool as e:
+                    # a worker died and took the pool with it: rebuild it, give each
+                    # affected image one more try (only the culprit should fail twice)
+                    _discard_pool("ocr", owner.pop(fut))
+                    if idx not in retried:
+                        retried.add(idx)
+                        error = submit_ocr(idx)
+                        if error is None:
+                            continue
+                    else:
+                        error = f"{stage} failed: OCR worker crashed ({e})"
+                    yield self._failed(results.pop(idx), error)
+                    continue
+                except Exception as e:
+                    yield self._failed(results.pop(idx), f"{stage} failed: {e}")
+                    continue
+                seconds = out[-1]
+                res["timings"][stage] = round(seconds, 3)
+                self._record(stage, seconds)
+                if stage == "ocr":
+                    ocr = out[0]
+                    res["extracted"], res["boxes"] = ocr["text"], ocr["boxes"]
+                    res["confidences"], res["engine"] = ocr["confidences"], ocr["engine"]
+                    nxt = _pool("translate").submit(
+                        _translate_stage, self.translate_fn, res["extracted"], res["boxes"], self.target_lang
+                    )
+                    pending[nxt] = ("translate", idx)
+                elif stage == "translate":
+                    batch = out[0]
+                    res["translated"], res["detected"] = batch[0]
+                    res["translated_boxes"] = [t for t, _ in batch[1:]]
+                    nxt = _pool("render").submit(
+                        _render_stage, res["original_img"], res["boxes"], res["translated_boxes"]
+                    )
+                    pending[nxt] = ("render", idx)
+                else:
+                    res["image"], res["translated_img"] = out[0], out[1]
+                    yield results.pop(idx)
+        self._finish_stats(time.perf_counter() - started)
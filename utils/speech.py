@@ -1,13 +1,22 @@
 # utils/speech.py
 """
 Speech helpers:
-- speech_to_text(uploaded_file) -> transcribed text
+- speech_to_text(uploaded_file) -> (transcribed text, spoken language)
+- transcribe_stream(source) -> yields timestamped windows as they are transcribed
+- trim_silence(samples) -> speech-only samples + time map (energy VAD)
+- load_audio(source) -> 16 kHz mono float32 samples, decoded in memory
+- get_whisper_model(size) -> process-wide cached Whisper model
 - record_and_translate() -> record mic input, transcribe & translate
 - text_to_speech_bytes(text, lang='en') -> mp3 bytes
 """
 
 import os
+import shutil
+import subprocess
 import tempfile
+import threading
+import time
+import wave
 from io import BytesIO
 
 # Supported languages for TTS
@@ -41,14 +50,292 @@ SUPPORTED_SPEECH_LANGS = {
     "id": "Indonesian",
 }
 
-# Save uploaded file
-def _save_uploaded_file(uploaded_file, suffix=None):
-    name = getattr(uploaded_file, "name", "uploaded")
-    ext = os.path.splitext(name)[1] or (suffix or ".tmp")
-    fd, path = tempfile.mkstemp(suffix=ext)
-    with os.fdopen(fd, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    return path
+# ---- audio ingestion ----
+# Uploads and recordings are decoded straight into the 16 kHz mono float32 array
+# Whisper consumes. WAV is parsed in memory; everything else is streamed through
+# ffmpeg. A temp file is used only when ffmpeg can't read the container from a
+# pipe (e.g. m4a with the index at the end), and it is always deleted.
+SAMPLE_RATE = 16000
+
+try:
+    import numpy as np
+    _HAS_NUMPY = True
+except Exception:
+    _HAS_NUMPY = False
+
+
+def _audio_bytes(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    if hasattr(source, "getbuffer"):
+        return bytes(source.getbuffer())
+    return source.read()
+
+
+def _resample(audio, rate, sr):
+    if rate == sr or len(audio) == 0:
+        return audio
+    # linear interpolation; only reached for WAVs when ffmpeg is unavailable
+    n = int(round(len(audio) * sr / rate))
+    return np.interp(np.linspace(0, len(audio) - 1, n), np.arange(len(audio)), audio).astype(np.float32)
+
+
+def _pcm_to_float(frames, width, channels):
+    if width == 1:
+        audio = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        audio = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768
+    elif width == 4:
+        audio = np.frombuffer(frames, dtype="<i4").astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {width}")
+    if channels > 1:
+        audio = audio[: len(audio) // channels * channels].reshape(-1, channels).mean(axis=1)
+    return audio.astype(np.float32)
+
+
+def _is_wav(data):
+    return data[:4] == b"RIFF" and data[8:12] == b"WAVE"
+
+
+def _wav_blocks(data, sr, block_samples, info):
+    """Yield mono float32 blocks from a PCM WAV held in memory."""
+    with wave.open(BytesIO(data)) as w:
+        channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        info["duration"] = w.getnframes() / rate
+        step = max(1, int(block_samples * rate / sr))
+        while True:
+            frames = w.readframes(step)
+            if not frames:
+                break
+            yield _resample(_pcm_to_float(frames, width, channels), rate, sr)
+
+
+def _ffmpeg_cmd(src, sr):
+    return ["ffmpeg", "-nostdin", "-threads", "0", "-i", src,
+            "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sr), "pipe:1"]
+
+
+def _parse_duration(stderr, info):
+    # ffmpeg prints "Duration: HH:MM:SS.ss" in the input banner
+    for line in iter(stderr.readline, b""):
+        if "duration" not in info and b"Duration:" in line:
+            try:
+                h, m, s = line.split(b"Duration:")[1].split(b",")[0].strip().split(b":")
+                info["duration"] = int(h) * 3600 + int(m) * 60 + float(s)
+            except ValueError:
+                pass
+
+
+def _ffmpeg_blocks(data, sr, block_samples, info, suffix=""):
+    """Stream ffmpeg's decoded output in blocks instead of buffering the whole file."""
+    proc = subprocess.Popen(_ffmpeg_cmd("pipe:0", sr), stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def feed():
+        try:
+            proc.stdin.write(data)
+        except OSError:
+            pass  # ffmpeg gave up on the input early
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+    threading.Thread(target=feed, daemon=True).start()
+    threading.Thread(target=_parse_duration, args=(proc.stderr, info), daemon=True).start()
+    produced = False
+    try:
+        while True:
+            buf = proc.stdout.read(block_samples * 2)
+            if not buf:
+                break
+            produced = True
+            yield np.frombuffer(buf[: len(buf) // 2 * 2], dtype=np.int16).astype(np.float32) / 32768
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+    if produced:
+        return
+    # container needs seeking: fall back to a temp file, removed right after
+    fd, path = tempfile.mkstemp(suffix=suffix or ".audio")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        out = subprocess.run(_ffmpeg_cmd(path, sr), capture_output=True, check=True).stdout
+    finally:
+        os.unlink(path)
+    audio = np.frombuffer(out, dtype=np.int16).astype(np.float32) / 32768
+    info.setdefault("duration", len(audio) / sr)
+    for i in range(0, len(audio), block_samples):
+        yield audio[i:i + block_samples]
+
+
+def iter_audio_blocks(source, sr=SAMPLE_RATE, block_seconds=5.0, info=None):
+    """
+    Decode audio incrementally into mono float32 blocks at sr Hz.
+    info (a dict, optional) receives "duration" in seconds once it is known.
+    """
+    if not _HAS_NUMPY:
+        raise RuntimeError("numpy is required for audio decoding")
+    info = {} if info is None else info
+    block_samples = max(1, int(block_seconds * sr))
+    if hasattr(source, "raw_data") and hasattr(source, "frame_rate"):
+        seg = source.set_frame_rate(sr).set_channels(1).set_sample_width(2)
+        info["duration"] = len(seg) / 1000
+        raw = seg.raw_data
+        for i in range(0, len(raw), block_samples * 2):
+            yield np.frombuffer(raw[i:i + block_samples * 2], dtype=np.int16).astype(np.float32) / 32768
+        return
+    data = _audio_bytes(source)
+    if not data:
+        return
+    suffix = os.path.splitext(getattr(source, "name", "") or "")[1]
+    if _is_wav(data):
+        try:
+            with wave.open(BytesIO(data)) as w:
+                rate = w.getframerate()
+            if rate == sr or shutil.which("ffmpeg") is None:
+                yield from _wav_blocks(data, sr, block_samples, info)
+                return
+        except (wave.Error, ValueError, EOFError):
+            pass  # e.g. float/compressed WAV: let ffmpeg handle it
+    yield from _ffmpeg_blocks(data, sr, block_samples, info, suffix)
+
+
+def load_audio(source, sr=SAMPLE_RATE):
+    """
+    Decode audio into a mono float32 numpy array at sr Hz.
+    source: bytes, BytesIO / UploadedFile-like, or a pydub AudioSegment (in-browser recorder).
+    """
+    blocks = list(iter_audio_blocks(source, sr, block_seconds=60.0))
+    if not blocks:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(blocks)
+
+
+# ---- windowing for long audio ----
+# Long files are transcribed in bounded windows cut at the quietest point near
+# the window end, so words are not split and memory stays at ~one window.
+STREAM_WINDOW_SECONDS = float(os.environ.get("LINGUA_STT_WINDOW_SECONDS", "30"))
+STREAM_MIN_WINDOW_SECONDS = float(os.environ.get("LINGUA_STT_MIN_WINDOW_SECONDS", "15"))
+_ENERGY_FRAME_SECONDS = 0.03
+
+
+def _quietest_cut(audio, sr, min_samples):
+    """Sample index of the lowest-energy frame after min_samples."""
+    frame = max(1, int(sr * _ENERGY_FRAME_SECONDS))
+    tail = audio[min_samples:]
+    n = len(tail) // frame
+    if n == 0:
+        return len(audio)
+    energy = np.square(tail[: n * frame].reshape(n, frame)).mean(axis=1)
+    return min_samples + int(energy.argmin()) * frame + frame // 2
+
+
+def iter_audio_windows(source, window_seconds=None, min_window_seconds=None, sr=SAMPLE_RATE, info=None):
+    """Yield (start_seconds, samples) windows of at most window_seconds, split at silence."""
+    window_seconds = window_seconds or STREAM_WINDOW_SECONDS
+    min_window_seconds = min(min_window_seconds or STREAM_MIN_WINDOW_SECONDS, window_seconds)
+    max_samples = int(window_seconds * sr)
+    min_samples = int(min_window_seconds * sr)
+    buf = np.zeros(0, dtype=np.float32)
+    offset = 0
+    for block in iter_audio_blocks(source, sr, block_seconds=min(5.0, window_seconds), info=info):
+        buf = np.concatenate([buf, block])
+        while len(buf) >= max_samples:
+            cut = _quietest_cut(buf[:max_samples], sr, min_samples)
+            yield offset / sr, buf[:cut]
+            buf = buf[cut:]
+            offset += cut
+    if len(buf):
+        yield offset / sr, buf
+
+
+# ---- voice activity detection ----
+# Energy-based: frames well above the clip's noise floor count as speech. Short
+# pauses are kept (Whisper uses them as phrase boundaries); long silences are
+# cut out before decoding and a time map translates timestamps back.
+VAD_ENABLED = os.environ.get("LINGUA_VAD", "1") != "0"
+VAD_MARGIN_DB = float(os.environ.get("LINGUA_VAD_MARGIN_DB", "12"))
+VAD_FLOOR_DB = -55.0  # never treat anything quieter than this as speech
+VAD_DYNAMIC_RANGE_DB = 30.0
+VAD_MIN_SILENCE_SECONDS = 0.6
+VAD_MIN_SPEECH_SECONDS = 0.15
+VAD_PAD_SECONDS = 0.2
+
+
+def detect_speech(audio, sr=SAMPLE_RATE, margin_db=None):
+    """Return [(start_sample, end_sample)] regions that contain speech."""
+    frame = max(1, int(sr * _ENERGY_FRAME_SECONDS))
+    n = len(audio) // frame
+    if n == 0:
+        return []
+    rms = np.sqrt(np.square(audio[: n * frame].reshape(n, frame)).mean(axis=1))
+    db = 20 * np.log10(np.maximum(rms, 1e-10))
+    margin = VAD_MARGIN_DB if margin_db is None else margin_db
+    # relative to the noise floor, but never so high that quiet syllables of
+    # continuous speech (no real silence to estimate the floor from) are dropped
+    threshold = max(min(float(np.percentile(db, 10)) + margin, float(db.max()) - VAD_DYNAMIC_RANGE_DB), VAD_FLOOR_DB)
+    voiced = db > threshold
+    if not voiced.any():
+        return []
+    # frame runs -> sample regions, bridging pauses shorter than VAD_MIN_SILENCE_SECONDS
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], voiced.astype(np.int8), [0]])))
+    runs = [(int(s), int(e)) for s, e in zip(edges[::2], edges[1::2])]
+    gap = int(VAD_MIN_SILENCE_SECONDS / _ENERGY_FRAME_SECONDS)
+    merged = [list(runs[0])]
+    for s, e in runs[1:]:
+        if s - merged[-1][1] < gap:
+            merged[-1][1] = e
+        else:
+            merged.append([s, e])
+    pad = int(VAD_PAD_SECONDS * sr)
+    min_len = int(VAD_MIN_SPEECH_SECONDS * sr)
+    regions = []
+    for s, e in merged:
+        s, e = max(0, s * frame - pad), min(len(audio), e * frame + pad)
+        if e - s - 2 * pad < min_len:
+            continue  # clicks / pops
+        if regions and s <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], e)
+        else:
+            regions.append((s, e))
+    return regions
+
+
+def trim_silence(audio, sr=SAMPLE_RATE, margin_db=None):
+    """
+    Drop non-speech from audio. Returns (trimmed, time_map) where time_map is a
+    list of (trimmed_start_s, original_start_s, length_s) per kept region.
+    """
+    regions = detect_speech(audio, sr, margin_db)
+    time_map, pos = [], 0
+    for s, e in regions:
+        time_map.append((pos / sr, s / sr, (e - s) / sr))
+        pos += e - s
+    if not regions:
+        return np.zeros(0, dtype=np.float32), time_map
+    return np.concatenate([audio[s:e] for s, e in regions]), time_map
+
+
+def map_time(t, time_map):
+    """Map a time in the trimmed audio back to the original timeline."""
+    for trimmed_start, original_start, length in reversed(time_map):
+        if t >= trimmed_start:
+            return original_start + min(t - trimmed_start, length)
+    return time_map[0][1] if time_map else t
+
+
+def _to_audio_data(audio, sr=SAMPLE_RATE):
+    """float32 buffer -> speech_recognition.AudioData (16-bit PCM), no WAV file needed."""
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+    return sr_module.AudioData(pcm, sr, 2)
+
 
 # Try whisper
 try:
@@ -57,45 +344,232 @@ try:
 except Exception:
     _HAS_WHISPER = False
 
-# Try speech_recognition + pydub
+# Try speech_recognition (fallback recognizer)
 try:
-    import speech_recognition as sr
-    from pydub import AudioSegment
-    _HAS_SR = True 
+    import speech_recognition as sr_module
+    _HAS_SR = True
 except Exception:
     _HAS_SR = False
 
-def speech_to_text(uploaded_file, lang: str = "en") -> str:
-    """Transcribe audio file (uploaded_file is Streamlit UploadedFile)."""
-    path = _save_uploaded_file(uploaded_file)
+# ---- Whisper model registry ----
+# Modules are imported once per process, so this registry is shared by every
+# Streamlit session. Each size is loaded at most once and reused until evicted.
+WHISPER_SIZES = ("tiny", "base", "small", "medium")
+DEFAULT_WHISPER_SIZE = os.environ.get("LINGUA_WHISPER_MODEL", "small")
+WHISPER_IDLE_SECONDS = float(os.environ.get("LINGUA_WHISPER_IDLE_SECONDS", "1800"))
+
+_models = {}  # size -> {"model", "load_seconds", "bytes", "last_used", "uses"}
+_models_lock = threading.Lock()  # guards _models only; never held while loading
+_load_locks = {}  # size -> Lock, so one size loads at a time without blocking the others
+_sweeper = None
+
+
+def _model_bytes(model):
+    """Approximate resident size of a torch model (parameters + buffers)."""
+    total = 0
+    try:
+        for t in list(model.parameters()) + list(model.buffers()):
+            total += t.numel() * t.element_size()
+    except Exception:
+        pass
+    return total
+
+
+def _sweep_idle_models():
+    # background eviction, so idle processes actually give the memory back
+    while True:
+        time.sleep(max(1.0, min(60.0, WHISPER_IDLE_SECONDS / 4)))
+        evict_idle_models()
+
+
+def _start_sweeper():
+    global _sweeper
+    with _models_lock:
+        if _sweeper is None:
+            _sweeper = threading.Thread(target=_sweep_idle_models, daemon=True, name="whisper-sweeper")
+            _sweeper.start()
+
 
+def get_whisper_model(size=None):
+    """Return a loaded Whisper model, loading it once per process."""
+    if not _HAS_WHISPER:
+        raise RuntimeError("openai-whisper not installed. Run: pip install openai-whisper")
+    size = size or DEFAULT_WHISPER_SIZE
+    if size not in WHISPER_SIZES:
+        raise ValueError(f"Unsupported Whisper size: {size}")
+    with _models_lock:
+        entry = _models.get(size)
+        if entry is not None:
+            entry["last_used"] = time.time()
+            entry["uses"] += 1
+            return entry["model"]
+        load_lock = _load_locks.setdefault(size, threading.Lock())
+    with load_lock:
+        with _models_lock:
+            entry = _models.get(size)  # another thread may have loaded it meanwhile
+        if entry is None:
+            start = time.perf_counter()
+            model = whisper.load_model(size)
+            entry = {
+                "model": model,
+                "load_seconds": time.perf_counter() - start,
+                "bytes": _model_bytes(model),
+                "last_used": time.time(),
+                "uses": 0,
+            }
+            with _models_lock:
+                _models[size] = entry
+    _start_sweeper()
+    with _models_lock:
+        entry["last_used"] = time.time()
+        entry["uses"] += 1
+        return entry["model"]
+
+
+def evict_idle_models(max_idle_seconds=None):
+    """Drop models unused for longer than max_idle_seconds. Returns evicted sizes."""
+    if max_idle_seconds is None:
+        max_idle_seconds = WHISPER_IDLE_SECONDS
+    cutoff = time.time() - max_idle_seconds
+    with _models_lock:
+        evicted = [size for size, e in _models.items() if e["last_used"] < cutoff]
+        for size in evicted:
+            del _models[size]
+    return evicted
+
+
+def whisper_model_stats():
+    """Return {size: {"load_seconds", "bytes", "idle_seconds", "uses"}} for loaded models."""
+    now = time.time()
+    with _models_lock:
+        return {
+            size: {
+                "load_seconds": round(e["load_seconds"], 3),
+                "bytes": e["bytes"],
+                "idle_seconds": round(now - e["last_used"], 1),
+                "uses": e["uses"],
+            }
+            for size, e in _models.items()
+        }
+
+
+# Whisper codes that differ from the ones the translator / TTS use
+_WHISPER_TO_APP_LANG = {"zh": "zh-cn"}
+
+
+def _whisper_lang(lang):
+    """Whisper language code for a hint like 'en' / 'zh-cn', or None to auto-detect."""
+    if not lang or lang in ("auto", "unknown"):
+        return None
+    code = lang.lower().split("-")[0]
+    try:
+        from whisper.tokenizer import LANGUAGES
+        return code if code in LANGUAGES else None
+    except Exception:
+        return code
+
+
+def _recognizer(model_size=None):
+    """(whisper_model, None) or (None, sr.Recognizer); raises if neither is usable."""
     if _HAS_WHISPER:
         try:
-            model = whisper.load_model("small")
-            result = model.transcribe(path)
-            return result.get("text", "").strip()
+            return get_whisper_model(model_size), None
         except Exception:
             pass
-
     if _HAS_SR:
-        ext = os.path.splitext(path)[1].lower()
-        wav_path = path
-        if ext != ".wav":
+        return None, sr_module.Recognizer()
+    raise RuntimeError("No speech recognizer installed. Run: pip install openai-whisper")
+
+
+def transcribe_stream(source, lang=None, model_size=None, window_seconds=None, vad=None, task="transcribe"):
+    """
+    Transcribe audio window by window, yielding as each window finishes:
+    {"start", "end", "text", "segments": [{"start", "end", "text"}], "language",
+     "task", "translation", "speech_seconds", "progress"}
+    Times are seconds from the start of the audio; progress is 0..1, or None
+    while the total duration is unknown. With vad (default VAD_ENABLED), silence
+    is trimmed before decoding and windows without speech skip the recognizer.
+    lang is the spoken-language hint (None/'auto' = let Whisper detect it once,
+    on the first window with speech). "text" is always the transcript in the
+    spoken language. task='translate' additionally asks Whisper for English
+    ("translation", a second decoding pass unless the speech is already English);
+    "task" in each window says what was actually done.
+    """
+    vad = VAD_ENABLED if vad is None else vad
+    model, recognizer = _recognizer(model_size)
+    language = _whisper_lang(lang)
+    info = {}
+    prompt = translation_prompt = None
+    for start, audio in iter_audio_windows(source, window_seconds, info=info):
+        end = start + len(audio) / SAMPLE_RATE
+        if vad:
+            speech, time_map = trim_silence(audio)
+        else:
+            speech, time_map = audio, [(0.0, 0.0, len(audio) / SAMPLE_RATE)]
+        text, segments, translation = "", [], None
+        if len(speech) == 0:
+            pass
+        elif model is not None:
+            # the tail of the previous window keeps vocabulary/style consistent across cuts
+            result = model.transcribe(speech, initial_prompt=prompt, language=language, task="transcribe")
+            # detect once, then pin the language so later windows skip detection
+            language = language or result.get("language")
+            segments = [
+                {"start": round(start + map_time(s["start"], time_map), 2),
+                 "end": round(start + map_time(s["end"], time_map), 2),
+                 "text": s["text"].strip()}
+                for s in result.get("segments", []) if s.get("text", "").strip()
+            ]
+            text = result.get("text", "").strip()
+            prompt = text[-200:] or prompt
+            if task == "translate":
+                if language == "en" or not text:
+                    translation = text
+                else:
+                    translated = model.transcribe(speech, initial_prompt=translation_prompt,
+                                                  language=language, task="translate")
+                    translation = translated.get("text", "").strip()
+                    translation_prompt = translation[-200:] or translation_prompt
+        else:
             try:
-                wav_path = path + ".wav"
-                AudioSegment.from_file(path).export(wav_path, format="wav")
+                text = recognizer.recognize_google(_to_audio_data(speech), language=lang if language else "en")
             except Exception:
-                wav_path = path
+                text = ""
+            if text:
+                segments = [{"start": round(start + time_map[0][1], 2),
+                             "end": round(start + map_time(len(speech) / SAMPLE_RATE, time_map), 2),
+                             "text": text}]
+        duration = info.get("duration")
+        yield {
+            "start": round(start, 2),
+            "end": round(end, 2),
+            "text": text,
+            "segments": segments,
+            "language": _WHISPER_TO_APP_LANG.get(language, language) if language else "unknown",
+            "task": task if model is not None else "transcribe",
+            "translation": translation,
+            "speech_seconds": round(len(speech) / SAMPLE_RATE, 2),
+            "progress": round(min(1.0, end / duration), 3) if duration else None,
+        }
+
+
+def speech_to_text(uploaded_file, lang=None, model_size=None, task="transcribe"):
+    """
+    Transcribe audio (Streamlit UploadedFile, bytes/BytesIO, or recorder AudioSegment).
+    Returns (text, detected_lang); detected_lang is 'unknown' if it was not determined.
+    With task='translate' the text is Whisper's English translation when available.
+    """
+    text, language = [], "unknown"
+    try:
+        for w in transcribe_stream(uploaded_file, lang, model_size, task=task):
+            part = w["translation"] if w["task"] == "translate" else w["text"]
+            if part:
+                text.append(part)
+            language = w["language"]
+    except Exception:
+        return "", "unknown"
+    return " ".join(text).strip(), language
 
-        r = sr.Recognizer()
-        try:
-            with sr.AudioFile(wav_path) as source:
-                audio_data = r.record(source)
-            text = r.recognize_google(audio_data, language=lang)
-            return text
-        except Exception:
-            return ""
-    return ""
 
 # TTS with gTTS
 try:
@@ -0,0 +1,448 @@
+# utils/storage.py
+"""
+SQLite data access for users + history.
+- Storage(db_file) keeps a small thread-safe pool of connections
+- connections run in WAL mode so readers never block the writer
+- typed helpers replace the connect/execute/close blocks in app.py
+- schema changes go through utils/migrations.py
+- HistoryCache keeps each user's newest rows in memory, updated in place
+- HistoryWriter batches history inserts on a background thread
+"""
+
+import atexit
+import logging
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from utils.migrations import migrate
+
+HISTORY_COLUMNS = ["id", "user_id", "timestamp", "type", "detected_lang", "target_lang", "input", "output", "extra"]
+
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",  # safe with WAL, avoids an fsync per commit
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",  # ~8 MB page cache per connection
+)
+
+_LIKE_CLAUSE = "(input LIKE ? ESCAPE '\\' OR output LIKE ? ESCAPE '\\')"
+
+
+def _like_pattern(text: str) -> str:
+    return "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+# scripts written without spaces between words: a word-tokenized index can't search them
+_UNSPACED_SCRIPTS = re.compile(
+    "[\u0e00-\u0eff\u1000-\u109f\u1780-\u17ff\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]"
+)
+
+
+def _fts_query(text: str, tokenizer: Optional[str]) -> Optional[str]:
+    """
+    Turn free text into an FTS5 query, or None when only a LIKE scan gives the right answer.
+    trigram: the whole text as one phrase (substring match; needs >= 3 characters).
+    unicode61: every word must match as a prefix (not usable for unspaced scripts).
+    """
+    if tokenizer == "trigram":
+        text = text.strip()
+        return '"' + text.replace('"', '""') + '"' if len(text) >= 3 else None
+    if tokenizer is None or _UNSPACED_SCRIPTS.search(text):
+        return None
+    words = re.findall(r"[^\W_]+", text)
+    return " AND ".join(f'"{w}"*' for w in words) or None
+
+
+class Storage:
+    def __init__(self, db_file, pool_size: int = 4):
+        self.db_file = str(db_file)
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._pool_size = pool_size
+        self.has_fts = False
+        self.fts_tokenizer = None  # "trigram" / "unicode61" once the FTS index exists
+        self.init_schema()
+
+    # ---- pool ----
+    def _new_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, timeout=5, check_same_thread=False)
+        for pragma in _PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection; commits on success, rolls back on error."""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                grow = self._created < self._pool_size
+                if grow:
+                    self._created += 1
+            conn = self._new_connection() if grow else self._pool.get()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._pool.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    # ---- schema ----
+    def init_schema(self) -> int:
+        """Bring the database up to the latest migration; returns the schema version."""
+        with self.connection() as conn:
+            version = migrate(conn)
+            row = conn.execute("SELECT sql FROM sqlite_master WHERE name='history_fts'").fetchone()
+            self.has_fts = row is not None
+            if row is not None:
+                self.fts_tokenizer = "trigram" if "trigram" in row[0] else "unicode61"
+        return version
+
+    # ---- users ----
+    def get_user(self, username: str) -> Optional[Tuple[int, str, str]]:
+        """Return (id, username, password_hash) or None."""
+        with self.connection() as conn:
+            return conn.execute(
+                "SELECT id, username, password_hash FROM users WHERE username=?", (username,)
+            ).fetchone()
+
+    def create_user(self, username: str, email: str, password_hash: str) -> bool:
+        """Insert a user; False if username/email already exists."""
+        try:
+            with self.connection() as conn:
+                conn.execute(
+                    "INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)",
+                    (username, email, password_hash),
+                )
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    # ---- history ----
+    def save_history(self, user_id: Optional[int], entry_type: str, input_text: str, detected_lang: str,
+                     target_lang: str, output_text: str, extra_blob: Optional[bytes] = None) -> tuple:
+        """Insert one history row and return it (columns as HISTORY_COLUMNS)."""
+        ts = datetime.utcnow().isoformat()
+        values = (user_id, ts, entry_type, detected_lang, target_lang, input_text, output_text, extra_blob)
+        with self.connection() as conn:
+            cur = conn.execute(
+                "INSERT INTO history (user_id, timestamp, type, detected_lang, target_lang, input, output, extra) VALUES (?,?,?,?,?,?,?,?)",
+                values,
+            )
+            return (cur.lastrowid,) + values
+
+    def insert_history_many(self, entries: List[tuple]) -> List[tuple]:
+        """
+        Insert pre-timestamped (user_id, timestamp, type, detected_lang, target_lang,
+        input, output, extra) tuples in a single transaction; returns the full rows.
+        """
+        rows = []
+        with self.connection() as conn:
+            for values in entries:
+                cur = conn.execute(
+                    "INSERT INTO history (user_id, timestamp, type, detected_lang, target_lang, input, output, extra) VALUES (?,?,?,?,?,?,?,?)",
+                    values,
+                )
+                rows.append((cur.lastrowid,) + tuple(values))
+        return rows
+
+    def load_history(self, user_id: Optional[int]) -> List[tuple]:
+        """All history rows for a user, newest first (columns as HISTORY_COLUMNS)."""
+        with self.connection() as conn:
+            return conn.execute(
+                f"SELECT {', '.join(HISTORY_COLUMNS)} FROM history WHERE user_id=? ORDER BY id DESC", (user_id,)
+            ).fetchall()
+
+    def query_history(self, user_id: Optional[int], entry_type: Optional[str] = None,
+                      date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                      text: Optional[str] = None, before_id: Optional[int] = None,
+                      limit: int = 50) -> Tuple[List[tuple], Optional[int]]:
+        """
+        One page of a user's history, newest first, with filters applied in SQL.
+        Keyset pagination: pass the returned cursor as before_id to get the next page.
+        Returns (rows, next_before_id); next_before_id is None on the last page.
+        """
+        where, params = ["user_id=?"], [user_id]
+        if entry_type:
+            where.append("type=?")
+            params.append(entry_type)
+        if date_from is not None:
+            where.append("timestamp>=?")
+            params.append(date_from.isoformat())
+        if date_to is not None:
+            where.append("timestamp<=?")
+            params.append(date_to.isoformat())
+        if text:
+            match = _fts_query(text, self.fts_tokenizer)
+            if match:
+                where.append("id IN (SELECT rowid FROM history_fts WHERE history_fts MATCH ?)")
+                params.append(match)
+            else:
+                where.append(_LIKE_CLAUSE)
+                params += [_like_pattern(text)] * 2
+        if before_id is not None:
+            where.append("id<?")
+            params.append(before_id)
+        sql = (
+            f"SELECT {', '.join(HISTORY_COLUMNS)} FROM history WHERE {' AND '.join(where)} "
+            "ORDER BY id DESC LIMIT ?"
+        )
+        with self.connection() as conn:
+            rows = conn.execute(sql, params + [limit + 1]).fetchall()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, rows[-1][0]
+        return rows, None
+
+    def search_history(self, user_id: Optional[int], text: str, limit: int = 20,
+                       offset: int = 0) -> List[tuple]:
+        """Full-text search over input/output, best matches first (bm25)."""
+        match = _fts_query(text, self.fts_tokenizer)
+        cols = ", ".join(f"h.{c}" for c in HISTORY_COLUMNS)
+        with self.connection() as conn:
+            if match:
+                return conn.execute(
+                    f"SELECT {cols} FROM history_fts JOIN history h ON h.id = history_fts.rowid "
+                    "WHERE history_fts MATCH ? AND h.user_id=? ORDER BY bm25(history_fts) LIMIT ? OFFSET ?",
+                    (match, user_id, limit, offset),
+                ).fetchall()
+            pattern = _like_pattern(text)
+            return conn.execute(
+                f"SELECT {cols} FROM history h WHERE h.user_id=? AND {_LIKE_CLAUSE} "
+                "ORDER BY h.id DESC LIMIT ? OFFSET ?",
+                (user_id, pattern, pattern, limit, offset),
+            ).fetchall()
+
+    def history_types(self, user_id: Optional[int]) -> List[str]:
+        """Distinct entry types a user has (served from the (user_id, type) index)."""
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT type FROM history WHERE user_id=? ORDER BY type", (user_id,)
+            ).fetchall()
+        return [r[0] for r in rows if r[0]]
+
+    def clear_history(self, user_id: Optional[int]) -> int:
+        """Delete a user's history; returns number of rows removed."""
+        with self.connection() as conn:
+            return conn.execute("DELETE FROM history WHERE user_id=?", (user_id,)).rowcount
+
+
+class HistoryCache:
+    """
+    Per-user cache of the newest history rows, shared by all sessions.
+    Writes go through it so each user's entry is patched incrementally
+    (new rows prepended, cleared users dropped) instead of flushing every user.
+    Only unfiltered pages are served from memory; filtered queries hit SQL.
+    """
+
+    def __init__(self, storage: Storage, max_rows: int = 500, max_users: int = 256):
+        self.storage = storage
+        self.max_rows = max_rows
+        self.max_users = max_users
+        self._users = OrderedDict()  # user_id -> {"rows": [...newest first], "complete": bool, "types": set}
+        self._versions = {}  # user_id -> write counter, detects writes racing a load
+        self._lock = threading.Lock()
+
+    def _entry(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                self._users.move_to_end(user_id)
+                return entry
+            version = self._versions.get(user_id, 0)
+        rows, next_before = self.storage.query_history(user_id, limit=self.max_rows)
+        entry = {
+            "rows": rows,
+            "complete": next_before is None,
+            "types": set(self.storage.history_types(user_id)),
+        }
+        with self._lock:
+            if self._versions.get(user_id, 0) != version:
+                # written to while loading: serve this snapshot but don't keep it
+                return entry
+            entry = self._users.setdefault(user_id, entry)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return entry
+
+    def page(self, user_id: Optional[int], before_id: Optional[int] = None,
+             limit: int = 50) -> Tuple[List[tuple], Optional[int]]:
+        """Same contract as Storage.query_history without filters."""
+        entry = self._entry(user_id)
+        with self._lock:
+            rows = entry["rows"]
+            complete = entry["complete"]
+            start = 0 if before_id is None else next((i for i, r in enumerate(rows) if r[0] < before_id), len(rows))
+            page = rows[start:start + limit + 1]
+        if len(page) > limit:
+            page = page[:limit]
+            return page, page[-1][0]
+        if complete:
+            return page, None
+        # ran past the cached window
+        return self.storage.query_history(user_id, before_id=before_id, limit=limit)
+
+    def types(self, user_id: Optional[int]) -> List[str]:
+        entry = self._entry(user_id)
+        with self._lock:
+            return sorted(t for t in entry["types"] if t)
+
+    def save_history(self, user_id: Optional[int], *args, **kwargs) -> tuple:
+        """Storage.save_history, then prepend the row to that user's cached entry."""
+        row = self.storage.save_history(user_id, *args, **kwargs)
+        self.add(row)
+        return row
+
+    def add(self, row: tuple):
+        """Record an already-committed row in its user's cached entry."""
+        user_id = row[1]
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            entry = self._users.get(user_id)
+            if entry is None:
+                return
+            entry["rows"].insert(0, row)
+            entry["types"].add(row[3])
+            if len(entry["rows"]) > self.max_rows:
+                entry["rows"].pop()
+                entry["complete"] = False
+
+    def clear_history(self, user_id: Optional[int]) -> int:
+        """Storage.clear_history, then drop only that user's entry."""
+        removed = self.storage.clear_history(user_id)
+        self.invalidate(user_id)
+        return removed
+
+    def invalidate(self, user_id: Optional[int]):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._users.pop(user_id, None)
+
+
+class HistoryWriter:
+    """
+    Write-behind queue for history rows. submit() timestamps the entry and returns
+    immediately; a daemon thread commits queued rows in batches (every
+    flush_interval seconds or batch_size rows) and hands each committed row to
+    on_commit. Pending rows are drained at interpreter exit.
+    """
+
+    def __init__(self, storage: Storage, on_commit: Optional[Callable[[tuple], None]] = None,
+                 max_queue: int = 1000, batch_size: int = 100, flush_interval: float = 0.5):
+        self.storage = storage
+        self.on_commit = on_commit
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, user_id: Optional[int], entry_type: str, input_text: str, detected_lang: str,
+               target_lang: str, output_text: str, extra_blob: Optional[bytes] = None):
+        """Queue one history row (same arguments as Storage.save_history)."""
+        values = (user_id, datetime.utcnow().isoformat(), entry_type, detected_lang, target_lang,
+                  input_text, output_text, extra_blob)
+        if self._stop.is_set():
+            self._commit([values])
+            return
+        try:
+            self._queue.put(values, timeout=1)
+        except queue.Full:
+            # writer is behind; don't drop the row, write it on the caller's thread
+            self._commit([values])
+
+    def flush(self, timeout: Optional[float] = None):
+        """Block until everything queued so far is committed."""
+        if self._stop.is_set():
+            return
+        marker = threading.Event()
+        self._queue.put(marker)
+        marker.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        """Stop the thread after draining the queue."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _commit(self, batch: List[tuple]):
+        try:
+            rows = self.storage.insert_history_many(batch)
+        except Exception:
+            # the batch transaction rolled back: retry row by row so only the bad
+            # row (e.g. a stale user_id failing the foreign key) is lost
+            logging.warning("history batch of %d rows failed; retrying one at a time", len(batch))
+            rows = []
+            for values in batch:
+                try:
+                    rows.extend(self.storage.insert_history_many([values]))
+                except Exception:
+                    logging.exception("history write failed for user %s", values[0])
+        if self.on_commit:
+            for row in rows:
+                try:
+                    self.on_commit(row)
+                except Exception:
+                    logging.exception("history on_commit failed")
+
+    def _run(self):
+        while True:
+            batch, markers, done = [], [], False
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    done = True
+                elif isinstance(item, threading.Event):
+                    markers.append(item)
+                else:
+                    batch.append(item)
+                if markers or len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if done:
+                # drain anything still queued behind the stop sentinel
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, threading.Event):
+                        markers.append(item)
+                    elif item is not None:
+                        batch.append(item)
+            if batch:
+                self._commit(batch)
+            for marker in markers:
+                marker.set()
+            if done:
+                return
@@ -0,0 +1,273 @@
+# utils/transcription_jobs.py
+"""
+Background transcription:
+- a process pool whose workers each keep a warm Whisper model
+- a bounded job queue (submit() refuses work beyond LINGUA_STT_MAX_QUEUE)
+- per-job status / progress / partial text, and cancellation
+
+The UI submits a job, stores its id and polls status() instead of running
+Whisper in the Streamlit script thread.
+"""
+
+import atexit
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from utils import speech
+
+STT_WORKERS = int(os.environ.get("LINGUA_STT_WORKERS", "1"))
+STT_MAX_QUEUE = int(os.environ.get("LINGUA_STT_MAX_QUEUE", "8"))
+JOB_TTL_SECONDS = 3600  # finished jobs are forgotten after this long
+
+FINISHED = ("done", "error", "cancelled")
+
+# ---- worker side (runs inside the pool processes) ----
+_events = None
+_cancelled = None
+
+
+def _worker_init(events, cancelled, model_size):
+    global _events, _cancelled
+    _events, _cancelled = events, cancelled
+    try:
+        speech.get_whisper_model(model_size)  # load once per worker, before the first job
+    except Exception:
+        pass  # no Whisper: jobs fall back to speech_recognition
+
+
+def _worker_transcribe(job_id, data, lang, model_size, task):
+    if job_id in _cancelled:
+        return {"cancelled": True}
+    _events.put((job_id, "running", None))
+    text, translation, segments, language, done_task = [], [], [], "unknown", task
+    for window in speech.transcribe_stream(data, lang, model_size, task=task):
+        if job_id in _cancelled:
+            return {"cancelled": True}
+        if window["text"]:
+            text.append(window["text"])
+        if window["translation"]:
+            translation.append(window["translation"])
+        segments.extend(window["segments"])
+        language, done_task = window["language"], window["task"]
+        _events.put((job_id, "window", window))
+    return {"text": " ".join(text).strip(), "translation": " ".join(translation).strip(),
+            "segments": segments, "language": language, "task": done_task}
+
+
+# ---- main-process side ----
+def _as_bytes(source):
+    """Picklable payload for the worker: raw upload bytes, or a WAV for recorder AudioSegments."""
+    if hasattr(source, "raw_data") and hasattr(source, "frame_rate"):
+        buf = BytesIO()
+        with wave.open(buf, "wb") as w:
+            w.setnchannels(source.channels)
+            w.setsampwidth(source.sample_width)
+            w.setframerate(source.frame_rate)
+            w.writeframes(source.raw_data)
+        return buf.getvalue()
+    return speech._audio_bytes(source)
+
+
+class TranscriptionJobs:
+    """Job queue in front of a pool of transcription workers."""
+
+    def __init__(self, workers=None, max_queue=None, model_size=None):
+        self.workers = max(1, workers or STT_WORKERS)
+        self.max_queue = max_queue or STT_MAX_QUEUE
+        self.model_size = model_size
+        self._jobs = {}
+        self._futures = {}
+        self._owners = {}  # job id -> pool it was submitted to
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._manager = None
+        self._events = None
+        self._cancelled = None
+        atexit.register(self.shutdown)
+
+    def _start(self):
+        if self._pool is not None:
+            return
+        try:
+            # spawn: forking a process that already holds threads/torch state is unsafe
+            ctx = multiprocessing.get_context("spawn")
+            self._manager = ctx.Manager()
+            self._events, self._cancelled = ctx.Queue(), self._manager.dict()
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=ctx, initializer=_worker_init,
+                initargs=(self._events, self._cancelled, self.model_size),
+            )
+        except Exception:
+            # no multiprocessing available (restricted hosts): fall back to threads
+            self._manager = None
+            self._events, self._cancelled = queue.Queue(), {}
+            _worker_init(self._events, self._cancelled, self.model_size)
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="stt")
+        threading.Thread(target=self._collect, args=(self._events,), daemon=True, name="stt-events").start()
+
+    def _discard_pool(self, pool):
+        """Drop a broken pool (a worker died, e.g. OOM) so the next submit() respawns workers. Call with _lock held."""
+        if pool is None or self._pool is not pool:
+            return
+        self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        if self._manager is not None:
+            try:
+                self._manager.shutdown()
+            except Exception:
+                pass
+        self._manager = None
+        try:
+            self._events.put((None, "stop", None))  # ends the old collector thread
+        except Exception:
+            pass
+
+    def _collect(self, events):
+        """Apply progress events from the workers to the job table."""
+        while True:
+            try:
+                job_id, kind, payload = events.get()
+            except (EOFError, OSError):
+                return
+            if kind == "stop":
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job["state"] in FINISHED:
+                    continue
+                if kind == "running" and job["state"] == "queued":
+                    job["state"], job["started"] = "running", time.time()
+                elif kind == "window":
+                    if payload["text"]:
+                        job["text"] = (job["text"] + " " + payload["text"]).strip()
+                    job["segments"].extend(payload["segments"])
+                    job["progress"] = payload["progress"]
+                    job["audio_seconds"] = payload["end"]
+                    job["language"] = payload["language"]
+
+    def _finish(self, job_id, future):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            self._futures.pop(job_id, None)
+            pool = self._owners.pop(job_id, None)
+            cancelled = self._cancelled
+            if job is None:
+                return
+            job["finished"] = time.time()
+            if future.cancelled():
+                job["state"] = "cancelled"
+                return
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                self._discard_pool(pool)
+                job["state"], job["error"] = "error", "Transcription worker crashed (out of memory?); please retry."
+                return
+            except Exception as e:
+                job["state"], job["error"] = "error", str(e) or type(e).__name__
+                return
+            if result.get("cancelled"):
+                job["state"] = "cancelled"
+            else:
+                job.update(state="done", progress=1.0, text=result["text"], translation=result["translation"],
+                           segments=result["segments"], language=result["language"], task=result["task"])
+        if cancelled is not None:
+            try:
+                cancelled.pop(job_id, None)
+            except Exception:
+                pass  # manager already shut down
+
+    def _prune(self):
+        cutoff = time.time() - JOB_TTL_SECONDS
+        for job_id in [j for j, job in self._jobs.items() if job["finished"] and job["finished"] < cutoff]:
+            del self._jobs[job_id]
+
+    def submit(self, source, lang=None, model_size=None, task="transcribe"):
+        """
+        Queue a transcription and return its job id. Raises RuntimeError when the queue is full.
+        lang is the spoken-language hint (None = detect). "text" is always the spoken-language
+        transcript; task='translate' also fills "translation" with Whisper's English output.
+        """
+        data = _as_bytes(source)
+        with self._lock:
+            self._prune()
+            pending = sum(1 for job in self._jobs.values() if job["state"] not in FINISHED)
+            if pending >= self.max_queue:
+                raise RuntimeError("Transcription queue is full, please try again shortly.")
+            self._start()
+            job_id = next(self._ids)
+            self._jobs[job_id] = {
+                "id": job_id, "state": "queued", "progress": 0.0, "audio_seconds": 0.0,
+                "text": "", "translation": "", "segments": [], "language": "unknown", "task": task, "error": None,
+                "created": time.time(), "started": None, "finished": None,
+            }
+            args = (_worker_transcribe, job_id, data, lang, model_size or self.model_size, task)
+            try:
+                future = self._pool.submit(*args)
+            except BrokenProcessPool:
+                # a worker died since the last job: respawn the pool and try once more
+                self._discard_pool(self._pool)
+                self._start()
+                future = self._pool.submit(*args)
+            self._futures[job_id] = future
+            self._owners[job_id] = self._pool
+        future.add_done_callback(lambda f, job_id=job_id: self._finish(job_id, f))
+        return job_id
+
+    def status(self, job_id):
+        """Snapshot of a job: state (queued/running/done/error/cancelled), progress, text, segments, ..."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job, segments=list(job["segments"]))
+            if job["state"] == "queued":
+                # position among queued jobs, 0 = next to start
+                snapshot["queue_position"] = sum(
+                    1 for j in self._jobs.values() if j["state"] == "queued" and j["id"] < job_id
+                )
+            return snapshot
+
+    def cancel(self, job_id):
+        """Cancel a job. Queued jobs never start; running ones stop after the current window."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            future = self._futures.get(job_id)
+            if job is None or job["state"] in FINISHED:
+                return False
+        if future is not None and future.cancel():
+            return True
+        try:
+            self._cancelled[job_id] = True
+        except Exception:
+            return False  # pool went away with its manager; the job fails on its own
+        return True
+
+    def stats(self):
+        with self._lock:
+            states = {}
+            for job in self._jobs.values():
+                states[job["state"]] = states.get(job["state"], 0) + 1
+        return {"workers": self.workers, "max_queue": self.max_queue, "jobs": states}
+
+    def shutdown(self):
+        if self._pool is None:
+            return
+        for job_id in list(self._futures):
+            self.cancel(job_id)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        if self._manager is not None:
+            try:
+                self._manager.shutdown()
+            except Exception:
+                pass
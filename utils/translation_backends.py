@@ -0,0 +1,177 @@
+# utils/translation_backends.py
+"""
+Translation backends behind a common interface:
+- googletrans  (network, supports newline-packed batches)
+- deep-translator  (network, Google endpoint)
+- local  (offline dictionary stand-in, for benchmarks / no-network machines)
+
+Pick one with LINGUA_TRANSLATOR_BACKEND or set_backend(); default is the first
+installed network backend, then local. Backends are created once per process.
+"""
+
+import json
+import os
+import threading
+import time
+
+# optional providers
+try:
+    from googletrans import Translator as _GoogletransClient
+    from googletrans import LANGUAGES as _GOOGLETRANS_LANGS
+    _HAS_GOOGLETRANS = True
+except Exception:
+    _HAS_GOOGLETRANS = False
+
+try:
+    from deep_translator import GoogleTranslator as _DeepGoogleTranslator
+    from deep_translator.constants import GOOGLE_LANGUAGES_TO_CODES as _DEEP_LANGS
+    _HAS_DEEP_TRANSLATOR = True
+except Exception:
+    _HAS_DEEP_TRANSLATOR = False
+
+
+class TranslationBackend:
+    """Base class. Subclasses implement translate(); detect() defaults to 'unknown'."""
+
+    name = "base"
+    cacheable = True  # whether results are worth keeping in translation memory
+    max_batch_chars = 0  # >0 if newline-joined texts can be sent in one call
+
+    def translate(self, text, target_lang, source_lang="auto"):
+        """Return (translated_text, detected_lang). source_lang skips provider-side detection."""
+        raise NotImplementedError
+
+    def source_code(self, lang):
+        """Provider spelling of a source language hint, or 'auto' if the provider does not know it."""
+        return lang or "auto"
+
+    def detect(self, text):
+        return "unknown"
+
+
+class GoogletransBackend(TranslationBackend):
+    name = "googletrans"
+    max_batch_chars = 4500
+
+    def __init__(self):
+        self._client = _GoogletransClient()
+
+    def source_code(self, lang):
+        code = (lang or "auto").lower()
+        return code if code in _GOOGLETRANS_LANGS else "auto"
+
+    def translate(self, text, target_lang, source_lang="auto"):
+        res = self._client.translate(text, dest=target_lang, src=source_lang)
+        return res.text, res.src
+
+    def detect(self, text):
+        return self._client.detect(text).lang
+
+
+class DeepTranslatorBackend(TranslationBackend):
+    name = "deep-translator"
+    max_batch_chars = 4500
+
+    def __init__(self):
+        # deep-translator issues a plain requests.get per call (no shared HTTP session to
+        # reuse), and translate() writes the text into the client's own URL params, so a
+        # client must not be shared between threads: keep one per (thread, source, target)
+        self._local = threading.local()
+
+    def source_code(self, lang):
+        # deep-translator is case sensitive ("zh-CN") and rejects codes it does not list
+        codes = {c.lower(): c for c in _DEEP_LANGS.values()}
+        return codes.get((lang or "auto").lower(), "auto")
+
+    def _client(self, target_lang, source_lang="auto"):
+        clients = getattr(self._local, "clients", None)
+        if clients is None:
+            clients = self._local.clients = {}
+        key = (source_lang, target_lang)
+        client = clients.get(key)
+        if client is None:
+            client = _DeepGoogleTranslator(source=source_lang, target=target_lang)
+            clients[key] = client
+        return client
+
+    def translate(self, text, target_lang, source_lang="auto"):
+        # deep-translator does not report the source language
+        detected = source_lang if source_lang != "auto" else "unknown"
+        return self._client(target_lang, source_lang).translate(text), detected
+
+
+class LocalBackend(TranslationBackend):
+    """
+    Offline stand-in. Looks phrases (then single words) up in a JSON dictionary
+    {target_lang: {source: translation}} from LINGUA_LOCAL_DICT; unknown words pass
+    through unchanged. LINGUA_LOCAL_LATENCY_MS adds a fake per-call delay for load tests.
+    """
+
+    name = "local"
+    cacheable = False
+    max_batch_chars = 4500
+
+    def __init__(self, dict_path=None, latency_ms=None):
+        dict_path = dict_path or os.environ.get("LINGUA_LOCAL_DICT")
+        self.latency = float(latency_ms if latency_ms is not None else os.environ.get("LINGUA_LOCAL_LATENCY_MS", "0")) / 1000
+        self.dictionary = {}
+        if dict_path and os.path.exists(dict_path):
+            with open(dict_path, encoding="utf-8") as f:
+                raw = json.load(f)
+            self.dictionary = {
+                lang: {k.lower(): v for k, v in entries.items()} for lang, entries in raw.items()
+            }
+
+    def translate(self, text, target_lang, source_lang="auto"):
+        if self.latency:
+            time.sleep(self.latency)
+        table = self.dictionary.get(target_lang, {})
+        lines = []
+        for line in text.split("\n"):
+            phrase = table.get(line.strip().lower())
+            if phrase is None:
+                phrase = " ".join(table.get(w.lower(), w) for w in line.split())
+            lines.append(phrase)
+        return "\n".join(lines), source_lang if source_lang != "auto" else "unknown"
+
+
+BACKENDS = {
+    "googletrans": (GoogletransBackend, _HAS_GOOGLETRANS),
+    "deep-translator": (DeepTranslatorBackend, _HAS_DEEP_TRANSLATOR),
+    "local": (LocalBackend, True),
+}
+
+_instances = {}
+_instances_lock = threading.Lock()
+_selected = os.environ.get("LINGUA_TRANSLATOR_BACKEND")
+
+
+def available_backends():
+    """Names of backends whose dependencies are installed."""
+    return [name for name, (_, ok) in BACKENDS.items() if ok]
+
+
+def set_backend(name):
+    """Select the backend used by get_backend() when no name is given."""
+    global _selected
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown translation backend: {name}")
+    _selected = name
+
+
+def get_backend(name=None):
+    """Return the (shared) backend instance for name, or the configured default."""
+    name = name or _selected
+    if name is None:
+        name = next(n for n in ("googletrans", "deep-translator", "local") if BACKENDS[n][1])
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown translation backend: {name}")
+    cls, ok = BACKENDS[name]
+    if not ok:
+        raise RuntimeError(f"Translation backend '{name}' is not installed.")
+    with _instances_lock:
+        backend = _instances.get(name)
+        if backend is None:
+            backend = cls()
+            _instances[name] = backend
+        return backend
@@ -0,0 +1,142 @@
+# utils/translation_cache.py
+"""
+Translation memory:
+- an in-process LRU in front of a `translation_cache` table in history.db
+- keyed on (normalized text, source lang, target lang, backend)
+- TTL + row-cap eviction, hit/miss counters via cache_stats()
+The table is created by utils/migrations.py; connections come from a Storage
+pool (the app's, via set_storage(), or one opened once per process).
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from utils.storage import Storage
+
+DB_FILE = Path(os.environ.get("LINGUA_DB_FILE", Path(__file__).resolve().parent.parent / "history.db"))
+MEMORY_ITEMS = int(os.environ.get("LINGUA_TM_MEMORY_ITEMS", "4096"))
+TTL_SECONDS = float(os.environ.get("LINGUA_TM_TTL_SECONDS", str(30 * 24 * 3600)))
+MAX_ROWS = int(os.environ.get("LINGUA_TM_MAX_ROWS", "50000"))
+_PRUNE_EVERY = 200  # writes between eviction passes
+
+_memory = OrderedDict()  # key -> (translated, detected, created_at)
+_lock = threading.Lock()
+_storage = None
+_storage_lock = threading.Lock()
+_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0}
+
+
+def normalize(text):
+    """Collapse whitespace so trivially different inputs share an entry."""
+    return " ".join((text or "").split())
+
+
+def set_storage(storage):
+    """Share an existing Storage (same database) instead of opening a second pool."""
+    global _storage
+    with _storage_lock:
+        _storage = storage
+
+
+def _get_storage():
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = Storage(DB_FILE)  # runs migrations, so the table exists
+        return _storage
+
+
+def _remember(key, value):
+    with _lock:
+        _memory[key] = value
+        _memory.move_to_end(key)
+        while len(_memory) > MEMORY_ITEMS:
+            _memory.popitem(last=False)
+
+
+def get(text, target_lang, backend, source_lang="auto"):
+    """Return cached (translated, detected) or None."""
+    key = (normalize(text), source_lang, target_lang, backend)
+    now = time.time()
+    with _lock:
+        hit = _memory.get(key)
+        if hit is not None and now - hit[2] <= TTL_SECONDS:
+            _memory.move_to_end(key)
+            _stats["memory_hits"] += 1
+            return hit[0], hit[1]
+    try:
+        with _get_storage().connection() as conn:
+            row = conn.execute(
+                "SELECT translated, detected_lang, created_at FROM translation_cache "
+                "WHERE source_text=? AND source_lang=? AND target_lang=? AND backend=?",
+                key,
+            ).fetchone()
+    except sqlite3.Error:
+        row = None
+    if row and now - row[2] <= TTL_SECONDS:
+        _remember(key, row)
+        with _lock:
+            _stats["disk_hits"] += 1
+        return row[0], row[1]
+    with _lock:
+        _stats["misses"] += 1
+    return None
+
+
+def put(text, target_lang, backend, translated, detected, source_lang="auto"):
+    """Store a translation in memory and on disk."""
+    key = (normalize(text), source_lang, target_lang, backend)
+    now = time.time()
+    _remember(key, (translated, detected, now))
+    try:
+        with _get_storage().connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO translation_cache VALUES (?,?,?,?,?,?,?)",
+                key + (translated, detected, now),
+            )
+    except sqlite3.Error:
+        return
+    with _lock:
+        _stats["writes"] += 1
+        due = _stats["writes"] % _PRUNE_EVERY == 0
+    if due:
+        prune()
+
+
+def prune():
+    """Delete expired rows and trim the table to MAX_ROWS (oldest first)."""
+    try:
+        with _get_storage().connection() as conn:
+            conn.execute("DELETE FROM translation_cache WHERE created_at < ?", (time.time() - TTL_SECONDS,))
+            conn.execute(
+                "DELETE FROM translation_cache WHERE rowid IN ("
+                "SELECT rowid FROM translation_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (MAX_ROWS,),
+            )
+    except sqlite3.Error:
+        pass
+
+
+def clear():
+    """Empty both cache layers."""
+    with _lock:
+        _memory.clear()
+    try:
+        with _get_storage().connection() as conn:
+            conn.execute("DELETE FROM translation_cache")
+    except sqlite3.Error:
+        pass
+
+
+def cache_stats():
+    """Return hit/miss counters and the in-memory size."""
+    with _lock:
+        stats = dict(_stats)
+        stats["memory_items"] = len(_memory)
+    lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+    stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 3) if lookups else 0.0
+    return stats
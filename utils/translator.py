@@ -1,6 +1,6 @@
 # utils/translator.py
 # Simple wrapper to detect language and translate text.
-# If you have a cloud provider, replace detect_and_translate implementation.
+# The provider is chosen in utils/translation_backends.py (LINGUA_TRANSLATOR_BACKEND).
 
 SUPPORTED_LANGS = {
     "en": "English",
@@ -11,34 +11,222 @@ SUPPORTED_LANGS = {
     "auto": "Auto-detect"
 }
 
-# try googletrans as optional fallback
+import unicodedata
+
+from utils import translation_cache
+from utils.translation_backends import get_backend
+
+# langdetect ships precomputed character n-gram profiles for ~55 languages
 try:
-    from googletrans import Translator as GoogleTranslator
-    _HAS_GOOGLETRANS = True
-    _gt = GoogleTranslator()
+    from langdetect import DetectorFactory, detect_langs
+    DetectorFactory.seed = 0  # deterministic results
+    _HAS_LANGDETECT = True
 except Exception:
-    _HAS_GOOGLETRANS = False
+    _HAS_LANGDETECT = False
+
+# ---- offline language detection ----
+# short strings (OCR words, greetings) give noisy n-gram statistics, so they
+# must clear a higher bar before we trust the result
+SHORT_TEXT_CHARS = 20
+SHORT_TEXT_MIN_CONFIDENCE = 0.90
+MIN_CONFIDENCE = 0.60
+
+# scripts used by a single language; answered without n-grams. Shared scripts
+# (Devanagari: hi/mr/ne/sa, Bengali: bn/as) are left to the n-gram profiles, since a
+# script guess there would skip translating e.g. Marathi into Hindi.
+_SCRIPT_LANGS = {
+    "GURMUKHI": "pa",
+    "GUJARATI": "gu",
+    "TAMIL": "ta",
+    "TELUGU": "te",
+    "THAI": "th",
+    "HANGUL": "ko",
+    "HIRAGANA": "ja",
+    "KATAKANA": "ja",
+}
+
+
+def _script_lang(text):
+    """Language implied by the dominant unambiguous script, or None."""
+    counts = {}
+    letters = 0
+    for ch in text:
+        if not ch.isalpha():
+            continue
+        letters += 1
+        script = unicodedata.name(ch, "").split(" ")[0]
+        lang = _SCRIPT_LANGS.get(script)
+        if lang:
+            counts[lang] = counts.get(lang, 0) + 1
+    if not counts:
+        return None
+    # Han characters are shared by zh/ja and are not mapped, so mixed text falls through to n-grams
+    lang, n = max(counts.items(), key=lambda kv: kv[1])
+    return lang if n * 2 >= letters else None
+
 
-def detect_and_translate(text, target_lang="en"):
+def detect_language(text, min_confidence=None):
+    """
+    Detect language locally (no network).
+    Returns (lang_code, confidence); ('unknown', 0.0) when not confident enough.
+    """
+    text = (text or "").strip()
+    if not text:
+        return "unknown", 0.0
+    lang = _script_lang(text)
+    if lang:
+        return lang, 1.0
+    if not _HAS_LANGDETECT:
+        return "unknown", 0.0
+    if min_confidence is None:
+        min_confidence = SHORT_TEXT_MIN_CONFIDENCE if len(text) < SHORT_TEXT_CHARS else MIN_CONFIDENCE
+    try:
+        best = detect_langs(text)[0]
+    except Exception:
+        return "unknown", 0.0
+    if best.prob < min_confidence:
+        return "unknown", best.prob
+    return best.lang, best.prob
+
+
+def detect_languages(texts, min_confidence=None):
+    """Batch form of detect_language; duplicates are detected once."""
+    seen = {}
+    for t in texts:
+        if t not in seen:
+            seen[t] = detect_language(t, min_confidence)
+    return [seen[t] for t in texts]
+
+
+def _backend():
+    """Configured backend, or None if it cannot be created (e.g. not installed)."""
+    try:
+        return get_backend()
+    except Exception:
+        return None
+
+
+def _translate_uncached(backend, text, target_lang, source_lang="auto"):
+    """Call the backend and store the result; falls back to echoing the input."""
+    try:
+        if target_lang == "auto":
+            # just detect and return original
+            result = text, backend.detect(text)
+        else:
+            result = backend.translate(text, target_lang, backend.source_code(source_lang))
+    except Exception:
+        if source_lang == "auto":
+            return text, "unknown"
+        # the provider rejected the hint (e.g. a code it does not list): let it detect instead
+        return _translate_uncached(backend, text, target_lang)
+    if backend.cacheable:
+        translation_cache.put(text, target_lang, backend.name, *result, source_lang=source_lang)
+    return result
+
+
+def detect_and_translate(text, target_lang="en", source_lang=None):
     """
     Returns (translated_text, detected_lang)
-    - If googletrans is installed, uses it.
-    - Otherwise returns input text and 'unknown' as detected language.
+    - Uses the configured translation backend, through the translation memory.
+    - If the backend is missing or fails, returns input text and 'unknown'.
+    - source_lang (e.g. from speech recognition) skips local and provider-side detection.
     """
     if not text:
         return "", "unknown"
-    if _HAS_GOOGLETRANS:
-        try:
-            # googletrans uses 'dest' param
+    if source_lang and source_lang not in ("auto", "unknown"):
+        local_lang, hint = source_lang, source_lang
+    else:
+        local_lang, hint = detect_language(text)[0], "auto"
+    if local_lang != "unknown" and target_lang in ("auto", local_lang):
+        # detection only, or already in the target language: no backend call needed
+        return text, local_lang
+    backend = _backend()
+    if backend is None:
+        # fallback: no translation, return original
+        return text, local_lang
+    if backend.cacheable:
+        cached = translation_cache.get(text, target_lang, backend.name, source_lang=hint)
+        if cached is not None:
             if target_lang == "auto":
-                # just detect and return original
-                det = _gt.detect(text).lang
-                return text, det
-            res = _gt.translate(text, dest=target_lang)
-            detected = res.src
-            return res.text, detected
+                return text, cached[1]
+            return cached
+    translated, detected = _translate_uncached(backend, text, target_lang, hint)
+    return translated, detected if detected != "unknown" else local_lang
+
+
+_BATCH_SEP = "\n"
+
+
+def _pack_chunks(texts, max_chars):
+    """Group texts into newline-joined chunks under max_chars. Texts with newlines go alone."""
+    chunks, current, size = [], [], 0
+    for t in texts:
+        if _BATCH_SEP in t or len(t) >= max_chars:
+            chunks.append([t])
+            continue
+        if current and size + len(t) + 1 > max_chars:
+            chunks.append(current)
+            current, size = [], 0
+        current.append(t)
+        size += len(t) + 1
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _translate_chunk(backend, chunk, target_lang):
+    """Translate one packed chunk; returns list of (translated, detected) per item."""
+    if len(chunk) > 1:
+        try:
+            translated, detected = backend.translate(_BATCH_SEP.join(chunk), target_lang)
+            parts = translated.split(_BATCH_SEP)
+            if len(parts) == len(chunk):
+                out = [(p.strip(), detected) for p in parts]
+                if backend.cacheable:
+                    for t, r in zip(chunk, out):
+                        translation_cache.put(t, target_lang, backend.name, *r)
+                return out
         except Exception:
             pass
-    # fallback: no translation, return original
-    return text, "unknown"
-    
\ No newline at end of file
+    # single item, or packing failed (line count changed): translate items one by one
+    return [_translate_uncached(backend, t, target_lang) for t in chunk]
+
+
+def translate_batch(texts, target_lang="en"):
+    """
+    Translate many texts at once.
+    Returns a list of (translated_text, detected_lang) in the same order as texts.
+    Duplicates are translated once and short texts are packed into as few
+    backend calls as possible. Texts detected locally as already being in
+    target_lang skip the backend.
+    """
+    texts = [t or "" for t in texts]
+    unique = [t for t in dict.fromkeys(texts) if t.strip()]
+    results = {}
+    local = dict(zip(unique, (lang for lang, _ in detect_languages(unique))))
+    remaining = []
+    for t in unique:
+        if local[t] != "unknown" and target_lang in ("auto", local[t]):
+            results[t] = (t, local[t])
+        else:
+            remaining.append(t)
+    backend = _backend()
+    if backend is None:
+        results.update((t, (t, local[t])) for t in remaining)
+    else:
+        pending = []
+        for t in remaining:
+            cached = translation_cache.get(t, target_lang, backend.name) if backend.cacheable else None
+            if cached is not None:
+                results[t] = (t, cached[1]) if target_lang == "auto" else cached
+            else:
+                pending.append(t)
+        if target_lang == "auto" or not backend.max_batch_chars:
+            chunks = [[t] for t in pending]
+        else:
+            chunks = _pack_chunks(pending, backend.max_batch_chars)
+        for chunk in chunks:
+            for t, (translated, detected) in zip(chunk, _translate_chunk(backend, chunk, target_lang)):
+                # a packed call reports one source language; prefer per-item local detection
+                results[t] = (translated, local[t] if local[t] != "unknown" else detected)
+    return [results[t] if t in results else ("", "unknown") for t in texts]